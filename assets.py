@@ -1,4 +1,5 @@
-from typing import Dict, List
+import json
+from typing import Dict, List, Optional
 from dataclasses import dataclass
 
 @dataclass
@@ -6,6 +7,7 @@ class ModelConfig:
     input_price: float
     output_price: float
     batch_support: bool = False
+    cached_input_price: Optional[float] = None   # defaults to input_price
 
 USER_AGENTS  = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/131.0.6778.265 Safari/537.36",
@@ -72,15 +74,18 @@ USER_AGENTS  = [
 PRICING: Dict[str, ModelConfig] = {
     "gpt-4o-mini": ModelConfig(
         input_price=0.150 / 1_000_000,
-        output_price=0.600 / 1_000_000
+        output_price=0.600 / 1_000_000,
+        cached_input_price=0.075 / 1_000_000
     ),
     "gpt-4o-2024-08-06": ModelConfig(
         input_price=2.5 / 1_000_000,    # $2.5 per 1M input tokens
-        output_price=10.0 / 1_000_000   # $10 per 1M output tokens
+        output_price=10.0 / 1_000_000,  # $10 per 1M output tokens
+        cached_input_price=1.25 / 1_000_000
     ),
     "gemini-1.5-flash": ModelConfig(
         input_price=0.075 / 1_000_000,  # $0.075 per 1M input tokens
-        output_price=0.30 / 1_000_000   # $0.30 per 1M output tokens
+        output_price=0.30 / 1_000_000,  # $0.30 per 1M output tokens
+        cached_input_price=0.01875 / 1_000_000
     ),
     "Llama3.1 8B": ModelConfig(
         input_price=0,                  # Free
@@ -142,10 +147,128 @@ RATE_LIMIT = {
 
 MAX_WORKERS = 3
 
+# Long-lived Playwright browsers kept by the Streamlit app (one per pool thread)
+BROWSER_POOL_SIZE = 2
+
+# Adaptive concurrency (AIMD): limits start at MAX_WORKERS, grow by
+# additive_increase per window of successes and shrink by
+# multiplicative_decrease on throttling, timeouts or rising p95 latency
+CONCURRENCY_SETTINGS = {
+    "initial_limit": MAX_WORKERS,
+    "min_limit": 1,
+    "max_global": 16,
+    "max_per_host": 6,
+    "additive_increase": 1,
+    "multiplicative_decrease": 0.5,
+    "latency_window": 20,
+    "p95_tolerance": 1.5,
+    "baseline_decay": 0.1,      # how fast the p95 baseline follows slower windows
+    "throttle_statuses": [429, 503],
+    "default_backoff": 5
+}
+
+# Structured data (JSON-LD, microdata, tables) extracted before calling the LLM
+STRUCTURED_DATA_SETTINGS = {
+    "enabled": True,
+    "min_match_score": 1.0,   # share of a field's words that must appear in the source key
+    "min_records": 2          # single-record sources are left to the LLM
+}
+
+# Listing de-duplication: exact hashes of normalized values, indexed in SQLite
+# so memory stays flat across runs. Near-duplicate detection (MinHash/LSH) is
+# opt-in over near_fields and only reports matches, since listings that differ
+# in one field (size, price, CPU) are usually distinct products
+DEDUP_SETTINGS = {
+    "enabled": True,
+    "index_path": "output/listings_index.sqlite",
+    "near_fields": [],      # e.g. ["description"]; empty disables near-duplicate reports
+    "threshold": 0.97,      # estimated Jaccard similarity that counts as a near duplicate
+    "num_perm": 64,         # MinHash signature length
+    "bands": 16,            # LSH bands (num_perm / bands rows each)
+    "shingle_size": 4       # character n-grams per listing text
+}
+
+# Per-domain browser session state (cookies + localStorage) reused across fetches
+SESSION_STATE_SETTINGS = {
+    "enabled": True,
+    "directory": ".session_state",
+    "ttl": 3600,                # seconds before a saved state is refreshed
+    "consent_settle": 1.0       # seconds to let a consent click land before saving
+}
+
+# Proxy pool, loaded from the SCRAPER_PROXIES env var (comma separated) or the
+# file below (one proxy URL per line); requests go direct when both are empty
+PROXY_SETTINGS = {
+    "env_var": "SCRAPER_PROXIES",
+    "file": "proxies.txt",
+    "ewma_alpha": 0.3,             # weight of the newest sample in latency/success averages
+    "min_host_samples": 3,         # per-host stats override global ones after this many uses
+    "quarantine_after": 3,         # consecutive failures before a proxy is benched
+    "quarantine_seconds": 300,
+    "sticky_ttl": 600,             # seconds a host/session keeps the same proxy
+    "top_k": 3                     # spread load across this many of the best proxies
+}
+
+ACCEPT_COOKIE_PHRASES = ["accept", "agree", "allow", "consent", "continue", "ok", "i agree", "got it"]
+
+# Clicks the first consent button in one round-trip; works as a Selenium
+# execute_script body and, wrapped in a function, with Playwright's evaluate.
+# Only buttons are clicked, never links, so "Continue reading" can't navigate away
+ACCEPT_COOKIES_SCRIPT = """
+const phrases = """ + json.dumps(ACCEPT_COOKIE_PHRASES) + """;
+const patterns = phrases.map(phrase => new RegExp("(^|[^a-z])" + phrase + "($|[^a-z])"));
+const navigates = element => {
+    const link = element.closest("a[href]");
+    const href = link ? link.getAttribute("href").trim() : "";
+    return href !== "" && !href.startsWith("#") && !href.toLowerCase().startsWith("javascript:");
+};
+for (const selector of ["button", "[role='button']"]) {
+    for (const element of document.querySelectorAll(selector)) {
+        const text = (element.innerText || "").trim().toLowerCase();
+        if (text && text.length <= 40 && !navigates(element) && patterns.some(pattern => pattern.test(text))) {
+            element.click();
+            return text;
+        }
+    }
+}
+return null;
+"""
+
+# Memory bounds for a single page: downloads are streamed and cut off at
+# max_bytes (browser-rendered pages at max_bytes characters)
+PAGE_SETTINGS = {
+    "max_bytes": 10 * 1024 * 1024,
+    "truncate": True,           # False raises PageTooLargeError instead
+    "chunk_size": 64 * 1024
+}
+
+# Per-URL tracing. Traces are Chrome trace-event JSON (open in ui.perfetto.dev
+# or chrome://tracing). "enabled" (or SCRAPER_TRACE=1) writes every URL; URLs
+# slower than slow_threshold seconds are stack-sampled and written regardless
+TRACE_SETTINGS = {
+    "enabled": False,
+    "directory": "traces",
+    "cpu_profile": False,       # cProfile CPU stages into .prof files
+    "har": False,               # record Playwright network timing as HAR
+    "slow_threshold": 20.0,     # 0 disables automatic sampling
+    "sample_interval": 0.01
+}
+
 HEADLESS_OPTIONS = [ "--headless=new","--disable-gpu", "--disable-dev-shm-usage","--window-size=1920,1080","--disable-search-engine-choice-screen"]
 
 PROGRESS_LOG_FILE = "scraping_progress.log"
 
+# Local OpenAI-compatible inference server (LM Studio / llama.cpp). With
+# "dispatch" on, page extractions share one dispatcher that keeps up to
+# max_in_flight requests outstanding (the server batches them) and lets
+# max_queue more wait before callers block
+LOCAL_LLM_SETTINGS = {
+    "base_url": "http://localhost:1234/v1",
+    "dispatch": True,
+    "max_in_flight": 4,
+    "max_queue": 64
+}
+
 LLAMA_MODEL_FULLNAME="lmstudio-community/Meta-Llama-3.1-8B-Instruct-GGUF"
 GROQ_LLAMA_MODEL_FULLNAME="llama-3.1-70b-versatile"
 
@@ -0,0 +1,58 @@
+"""Import-time benchmark for scraper.py.
+
+Imports the module in fresh interpreters, reports the median wall time and
+fails if it exceeds IMPORT_TIME_BUDGET_MS or if any heavy dependency was
+loaded eagerly.
+
+    python benchmark_import.py [--runs 5] [--budget-ms 200]
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+IMPORT_TIME_BUDGET_MS = 200
+# Must only be imported by the code paths that use them
+HEAVY_MODULES = [
+    "pandas", "bs4", "html2text", "tiktoken", "selenium", "webdriver_manager",
+    "openai", "google.generativeai", "groq", "tenacity", "playwright", "httpx"
+]
+
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+import scraper
+elapsed = (time.perf_counter() - start) * 1000
+heavy = [name for name in {heavy!r} if name in sys.modules]
+print(json.dumps({{"elapsed_ms": elapsed, "heavy": heavy}}))
+"""
+
+def measure_once() -> dict:
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(heavy=HEAVY_MODULES)],
+        capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=IMPORT_TIME_BUDGET_MS)
+    args = parser.parse_args()
+
+    samples = [measure_once() for _ in range(args.runs)]
+    median_ms = statistics.median(sample["elapsed_ms"] for sample in samples)
+    eager = sorted({name for sample in samples for name in sample["heavy"]})
+
+    print(f"import scraper: median {median_ms:.1f} ms over {args.runs} runs (budget {args.budget_ms:.0f} ms)")
+    if eager:
+        print(f"Heavy modules loaded at import time: {', '.join(eager)}")
+    if median_ms > args.budget_ms or eager:
+        print("FAIL")
+        return 1
+    print("OK")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
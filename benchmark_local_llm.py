@@ -0,0 +1,94 @@
+"""Throughput benchmark for the local Llama endpoint with and without the dispatcher.
+
+Starts a stand-in OpenAI-compatible server that, like a local inference box,
+serves up to --slots requests in parallel with a fixed per-request latency,
+then extracts --pages pages one blocking call at a time and through the
+LocalDispatcher.
+
+    python benchmark_local_llm.py [--pages 32] [--slots 4] [--latency 0.2]
+    python benchmark_local_llm.py --base-url http://localhost:1234/v1   # real server
+"""
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from assets import LOCAL_LLM_SETTINGS
+from local_llm import LocalDispatcher, complete_local
+
+RESPONSE = {
+    "id": "chatcmpl-standin",
+    "object": "chat.completion",
+    "created": 0,
+    "model": "standin",
+    "choices": [{"index": 0, "finish_reason": "stop",
+                 "message": {"role": "assistant", "content": "{\"listings\": []}"}}],
+    "usage": {"prompt_tokens": 100, "completion_tokens": 5, "total_tokens": 105}
+}
+
+
+def start_standin_server(slots: int, latency: float) -> ThreadingHTTPServer:
+    capacity = threading.BoundedSemaphore(slots)
+
+    class Handler(BaseHTTPRequestHandler):
+        def do_POST(self):
+            self.rfile.read(int(self.headers.get("Content-Length", 0)))
+            with capacity:
+                time.sleep(latency)
+            body = json.dumps(RESPONSE).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=32)
+    parser.add_argument("--slots", type=int, default=4)
+    parser.add_argument("--latency", type=float, default=0.2)
+    parser.add_argument("--max-in-flight", type=int, default=LOCAL_LLM_SETTINGS["max_in_flight"])
+    parser.add_argument("--base-url", help="benchmark an existing server instead of the stand-in")
+    args = parser.parse_args()
+
+    from openai import OpenAI
+
+    server = None
+    base_url = args.base_url
+    if base_url is None:
+        server = start_standin_server(args.slots, args.latency)
+        base_url = f"http://127.0.0.1:{server.server_address[1]}/v1"
+    client = OpenAI(base_url=base_url, api_key="lm-studio")
+    messages = [{"role": "system", "content": "Extract listings."}, {"role": "user", "content": "Page content"}]
+
+    start = time.perf_counter()
+    for _ in range(args.pages):
+        complete_local(client, messages)
+    sequential = time.perf_counter() - start
+
+    dispatcher = LocalDispatcher(lambda request: complete_local(client, request), max_in_flight=args.max_in_flight)
+    start = time.perf_counter()
+    futures = [dispatcher.submit(messages) for _ in range(args.pages)]
+    for future in futures:
+        future.result()
+    dispatched = time.perf_counter() - start
+    dispatcher.close()
+
+    print(f"sequential: {args.pages / sequential:.1f} pages/s ({sequential:.2f} s)")
+    print(f"dispatched: {args.pages / dispatched:.1f} pages/s ({dispatched:.2f} s), "
+          f"max in flight {args.max_in_flight}")
+    if server is not None:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+import math
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from typing import Dict, Optional
+from urllib.parse import urlparse
+
+from assets import CONCURRENCY_SETTINGS, RETRY_SETTINGS
+
+
+class ThrottledError(Exception):
+    """Raised by fetchers when the origin answers with a throttling status"""
+
+    def __init__(self, url: str, status: int, retry_after: Optional[float] = None):
+        super().__init__(f"{url} throttled with status {status}")
+        self.url = url
+        self.status = status
+        self.retry_after = retry_after
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """Parse a Retry-After header (delta seconds or HTTP date) into seconds"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+
+def is_backoff_error(error: BaseException) -> bool:
+    """Throttling and timeouts mean the target is overloaded, other errors don't"""
+    if isinstance(error, ThrottledError):
+        return True
+    status = getattr(getattr(error, "response", None), "status_code", None)
+    if status in CONCURRENCY_SETTINGS["throttle_statuses"]:
+        return True
+    return "timeout" in type(error).__name__.lower()
+
+
+def retry_delay(attempt: int, error: Optional[BaseException] = None) -> float:
+    """Exponential backoff from RETRY_SETTINGS, stretched to honor Retry-After"""
+    delay = RETRY_SETTINGS["base_delay"] * RETRY_SETTINGS["exponential_base"] ** max(0, attempt - 1)
+    retry_after = getattr(error, "retry_after", None)
+    if retry_after is not None:
+        delay = max(delay, retry_after)
+    return min(delay, RETRY_SETTINGS["max_delay"])
+
+
+class AIMDLimit:
+    """A single additive-increase / multiplicative-decrease concurrency limit.
+
+    With track_latency a rising p95 also backs the limit off; without it
+    only explicit decrease() calls (throttling, timeouts) do.
+    """
+
+    def __init__(self, initial: float, minimum: float, maximum: float, settings: Dict = CONCURRENCY_SETTINGS,
+                 track_latency: bool = True):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.settings = settings
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self.latencies = deque(maxlen=settings["latency_window"]) if track_latency else None
+        self.baseline_p95: Optional[float] = None
+
+    def has_capacity(self, now: float) -> bool:
+        return self.in_flight < math.floor(self.limit) and now >= self.blocked_until
+
+    def p95(self) -> Optional[float]:
+        if self.latencies is None or len(self.latencies) < self.latencies.maxlen // 2:
+            return None
+        ordered = sorted(self.latencies)
+        return ordered[min(len(ordered) - 1, int(0.95 * len(ordered)))]
+
+    def on_success(self, latency: float):
+        if self.latencies is not None:
+            self.latencies.append(latency)
+        p95 = self.p95()
+        if p95 is not None:
+            if self.baseline_p95 is None:
+                self.baseline_p95 = p95
+            elif p95 > self.baseline_p95 * self.settings["p95_tolerance"]:
+                # Latency is climbing: the target is queueing our requests.
+                # Re-learn the baseline at the new limit rather than keep an old fast one
+                self.decrease()
+                self.latencies.clear()
+                self.baseline_p95 = None
+                return
+            else:
+                # Drop to faster windows at once, drift slowly up towards slower ones
+                decay = self.settings["baseline_decay"]
+                self.baseline_p95 = min(p95, (1 - decay) * self.baseline_p95 + decay * p95)
+        # One extra slot per window of `limit` successes
+        self.limit = min(self.maximum, self.limit + self.settings["additive_increase"] / self.limit)
+
+    def decrease(self, pause: float = 0.0):
+        self.limit = max(self.minimum, self.limit * self.settings["multiplicative_decrease"])
+        if pause:
+            self.blocked_until = max(self.blocked_until, time.monotonic() + pause)
+
+
+class ConcurrencyController:
+    """Adaptive global and per-host concurrency driven by latency and error rates.
+
+    Fetches run inside `slot(url)`, which waits for capacity and reports the
+    outcome back so limits grow while the target keeps up and back off on
+    429/503, timeouts or a rising p95.
+    """
+
+    def __init__(self, settings: Dict = CONCURRENCY_SETTINGS):
+        self.settings = settings
+        self._condition = threading.Condition()
+        # Latency is judged per host only: one slow but healthy host must not
+        # shrink the shared limit for every other host
+        self._global = AIMDLimit(settings["initial_limit"], settings["min_limit"], settings["max_global"], settings,
+                                 track_latency=False)
+        self._hosts: Dict[str, AIMDLimit] = {}
+
+    @property
+    def max_workers(self) -> int:
+        return self.settings["max_global"]
+
+    def _host(self, host: str) -> AIMDLimit:
+        if host not in self._hosts:
+            self._hosts[host] = AIMDLimit(
+                min(self.settings["initial_limit"], self.settings["max_per_host"]),
+                self.settings["min_limit"],
+                self.settings["max_per_host"],
+                self.settings
+            )
+        return self._hosts[host]
+
+    def limits(self) -> Dict[str, float]:
+        with self._condition:
+            limits = {host: state.limit for host, state in self._hosts.items()}
+            limits["*"] = self._global.limit
+            return limits
+
+    def acquire(self, host: str):
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                state = self._host(host)
+                if self._global.has_capacity(now) and state.has_capacity(now):
+                    self._global.in_flight += 1
+                    state.in_flight += 1
+                    return
+                wait = max(state.blocked_until, self._global.blocked_until) - now
+                self._condition.wait(timeout=wait if wait > 0 else 0.5)
+
+    def release(self, host: str, latency: float, error: Optional[BaseException] = None):
+        with self._condition:
+            state = self._host(host)
+            self._global.in_flight -= 1
+            state.in_flight -= 1
+            if error is None:
+                state.on_success(latency)
+                self._global.on_success(latency)
+            elif is_backoff_error(error):
+                retry_after = getattr(error, "retry_after", None)
+                state.decrease(pause=retry_after if retry_after is not None else self.settings["default_backoff"])
+                self._global.decrease()
+            self._condition.notify_all()
+
+    @contextmanager
+    def slot(self, url: str):
+        host = urlparse(url).netloc or url
+        self.acquire(host)
+        start = time.monotonic()
+        try:
+            yield
+        except BaseException as e:
+            self.release(host, time.monotonic() - start, e)
+            raise
+        self.release(host, time.monotonic() - start)
+
+
+def capped_settings(limit: int, settings: Dict = CONCURRENCY_SETTINGS) -> Dict:
+    """Settings for a controller whose fetches can't run more than `limit` at once.
+
+    Fetches handed to a fixed-size worker pool (like BrowserPool) would
+    otherwise hold slots while queueing, and the queueing time would read
+    as target latency.
+    """
+    capped = dict(settings)
+    for key in ("initial_limit", "max_global", "max_per_host"):
+        capped[key] = min(capped[key], limit)
+    capped["min_limit"] = min(capped["min_limit"], limit)
+    return capped
+
+
+_default_controller: Optional[ConcurrencyController] = None
+_default_lock = threading.Lock()
+
+
+def get_controller() -> ConcurrencyController:
+    """Process-wide controller so limits learned for a host carry over between batches"""
+    global _default_controller
+    with _default_lock:
+        if _default_controller is None:
+            _default_controller = ConcurrencyController()
+        return _default_controller
@@ -0,0 +1,170 @@
+import hashlib
+import json
+import logging
+import os
+import random
+import re
+import sqlite3
+import threading
+import unicodedata
+from array import array
+from typing import Dict, List, Optional, Tuple
+
+from assets import DEDUP_SETTINGS
+
+MERSENNE_PRIME = (1 << 61) - 1
+MAX_HASH = (1 << 64) - 1
+
+
+def normalize_value(value) -> str:
+    text = unicodedata.normalize("NFKC", str(value)).lower()
+    text = re.sub(r"(?<=\d),(?=\d{3})", "", text)
+    return " ".join(re.sub(r"[^\w.]+", " ", text).split())
+
+
+def normalize_listing(listing: dict) -> Dict[str, str]:
+    return {str(key).lower(): normalize_value(value) for key, value in listing.items() if value not in (None, "")}
+
+
+def exact_hash(normalized: Dict[str, str]) -> str:
+    return hashlib.sha1(json.dumps(normalized, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def _hash64(text: str) -> int:
+    return int.from_bytes(hashlib.blake2b(text.encode("utf-8"), digest_size=8).digest(), "little")
+
+
+class MinHasher:
+    def __init__(self, num_perm: int = DEDUP_SETTINGS["num_perm"], shingle_size: int = DEDUP_SETTINGS["shingle_size"], seed: int = 1):
+        rng = random.Random(seed)
+        self.shingle_size = shingle_size
+        self.permutations = [(rng.randrange(1, MERSENNE_PRIME), rng.randrange(0, MERSENNE_PRIME)) for _ in range(num_perm)]
+
+    def shingles(self, normalized: Dict[str, str]) -> set:
+        text = " | ".join(normalized[key] for key in sorted(normalized))
+        if len(text) <= self.shingle_size:
+            return {text}
+        return {text[i:i + self.shingle_size] for i in range(len(text) - self.shingle_size + 1)}
+
+    def signature(self, normalized: Dict[str, str]) -> array:
+        hashes = [_hash64(shingle) for shingle in self.shingles(normalized)]
+        return array("Q", (min(((a * h + b) % MERSENNE_PRIME) & MAX_HASH for h in hashes) for a, b in self.permutations))
+
+
+def similarity(first: array, second: array) -> float:
+    """Estimated Jaccard similarity of two MinHash signatures"""
+    return sum(x == y for x, y in zip(first, second)) / len(first)
+
+
+class ListingDeduplicator:
+    """Drops listings already seen across pages and runs.
+
+    Exact duplicates are caught by hashing normalized field values and are
+    dropped. When near_fields is set, listings whose values for those fields
+    are nearly identical (MinHash signatures bucketed with LSH) are reported
+    but kept. Everything lives in a SQLite index (in memory with ":memory:"),
+    so memory stays bounded no matter how many listings pass through.
+    """
+
+    def __init__(self, index_path: str = DEDUP_SETTINGS["index_path"], threshold: float = DEDUP_SETTINGS["threshold"],
+                 num_perm: int = DEDUP_SETTINGS["num_perm"], bands: int = DEDUP_SETTINGS["bands"],
+                 near_fields: Optional[List[str]] = None):
+        if num_perm % bands:
+            raise ValueError("num_perm must be divisible by bands")
+        if index_path != ":memory:":
+            os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+        self.threshold = threshold
+        self.near_fields = [field.lower() for field in (DEDUP_SETTINGS["near_fields"] if near_fields is None else near_fields)]
+        self.bands = bands
+        self.rows_per_band = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(index_path, check_same_thread=False)
+        self._db.executescript("""
+            CREATE TABLE IF NOT EXISTS exact (hash TEXT PRIMARY KEY);
+            CREATE TABLE IF NOT EXISTS signatures (id INTEGER PRIMARY KEY, signature BLOB NOT NULL);
+            CREATE TABLE IF NOT EXISTS buckets (band INTEGER, bucket TEXT, id INTEGER);
+            CREATE INDEX IF NOT EXISTS buckets_lookup ON buckets (band, bucket);
+        """)
+
+    def _buckets(self, signature: array) -> List[Tuple[int, str]]:
+        size = self.rows_per_band
+        return [(band, hashlib.sha1(signature[band * size:(band + 1) * size].tobytes()).hexdigest())
+                for band in range(self.bands)]
+
+    def _near_duplicate(self, signature: array, buckets) -> bool:
+        candidates = set()
+        for band, bucket in buckets:
+            candidates.update(row[0] for row in self._db.execute(
+                "SELECT id FROM buckets WHERE band = ? AND bucket = ?", (band, bucket)))
+        for candidate in candidates:
+            stored = array("Q")
+            stored.frombytes(self._db.execute("SELECT signature FROM signatures WHERE id = ?", (candidate,)).fetchone()[0])
+            if similarity(signature, stored) >= self.threshold:
+                return True
+        return False
+
+    def is_duplicate(self, listing: dict) -> Optional[str]:
+        """Return "exact" for a seen listing or "near" for a near match, otherwise None.
+
+        Anything that isn't an exact duplicate is indexed, near matches
+        included, in a transaction that only becomes permanent on commit().
+        """
+        normalized = normalize_listing(listing)
+        digest = exact_hash(normalized)
+        near = {key: value for key, value in normalized.items() if key in self.near_fields}
+        with self._lock:
+            if self._db.execute("SELECT 1 FROM exact WHERE hash = ?", (digest,)).fetchone():
+                return "exact"
+            self._db.execute("INSERT INTO exact (hash) VALUES (?)", (digest,))
+            if not near:
+                return None
+            signature = self.hasher.signature(near)
+            buckets = self._buckets(signature)
+            duplicate = "near" if self._near_duplicate(signature, buckets) else None
+            row_id = self._db.execute("INSERT INTO signatures (signature) VALUES (?)", (signature.tobytes(),)).lastrowid
+            self._db.executemany("INSERT INTO buckets (band, bucket, id) VALUES (?, ?, ?)",
+                                 [(band, bucket, row_id) for band, bucket in buckets])
+            return duplicate
+
+    def filter(self, listings: List[dict]) -> Tuple[List[dict], Dict[str, int]]:
+        """Drop exact duplicates and count near ones, which are kept"""
+        kept, stats = [], {"kept": 0, "exact": 0, "near": 0}
+        for listing in listings:
+            duplicate = self.is_duplicate(listing)
+            if duplicate:
+                stats[duplicate] += 1
+            if duplicate == "exact":
+                continue
+            if duplicate == "near":
+                logging.info(f"Possible near duplicate listing: {listing}")
+            kept.append(listing)
+            stats["kept"] += 1
+        return kept, stats
+
+    def commit(self):
+        """Keep the listings indexed since the last commit, once they have been saved"""
+        with self._lock:
+            self._db.commit()
+
+    def rollback(self):
+        """Forget the listings indexed since the last commit, e.g. when saving them failed"""
+        with self._lock:
+            self._db.rollback()
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+_default_deduplicator: Optional[ListingDeduplicator] = None
+_default_lock = threading.Lock()
+
+
+def get_deduplicator() -> ListingDeduplicator:
+    """Process-wide deduplicator backed by the persistent index in DEDUP_SETTINGS"""
+    global _default_deduplicator
+    with _default_lock:
+        if _default_deduplicator is None:
+            _default_deduplicator = ListingDeduplicator()
+        return _default_deduplicator
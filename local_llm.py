@@ -0,0 +1,83 @@
+import logging
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Dict, List
+
+from assets import LLAMA_MODEL_FULLNAME, LOCAL_LLM_SETTINGS
+from tracing import activate_trace, current_trace
+
+logger = logging.getLogger(__name__)
+
+
+def local_base_url() -> str:
+    return os.getenv("LOCAL_LLM_BASE_URL", LOCAL_LLM_SETTINGS["base_url"])
+
+
+def complete_local(client, messages: List[dict]):
+    """One chat completion against the local server"""
+    return client.chat.completions.create(
+        model=LLAMA_MODEL_FULLNAME,
+        messages=messages,
+        temperature=0.7,
+        # llama.cpp-based servers keep the KV cache of the shared prefix
+        extra_body={"cache_prompt": True}
+    )
+
+
+class LocalDispatcher:
+    """Keeps several requests to the local server in flight at once.
+
+    Local inference servers batch whatever is in flight on their side, so
+    concurrent requests get far more throughput than one blocking call at a
+    time. Nothing is held back client-side: a request goes out as soon as
+    one of `max_in_flight` slots is free. Up to `max_queue` more may wait;
+    beyond that `submit` blocks, pushing back on producers.
+    """
+
+    def __init__(self, send: Callable, max_in_flight: int = LOCAL_LLM_SETTINGS["max_in_flight"],
+                 max_queue: int = LOCAL_LLM_SETTINGS["max_queue"]):
+        self.send = send
+        self._pending = threading.BoundedSemaphore(max_in_flight + max_queue)
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight, thread_name_prefix="local-llm")
+        self._closed = False
+
+    def submit(self, request) -> Future:
+        if self._closed:
+            raise RuntimeError("LocalDispatcher is closed")
+        self._pending.acquire()
+        try:
+            future = self._executor.submit(self._send, request, current_trace())
+        except BaseException:
+            self._pending.release()
+            raise
+        future.add_done_callback(lambda _future: self._pending.release())
+        return future
+
+    def _send(self, request, trace=None):
+        # Keep the request on its URL's trace so slow-page samples include this thread
+        with activate_trace(trace):
+            return self.send(request)
+
+    def close(self):
+        self._closed = True
+        self._executor.shutdown(wait=True)
+
+
+_dispatchers: Dict[str, LocalDispatcher] = {}
+_dispatchers_lock = threading.Lock()
+
+
+def get_local_dispatcher(client) -> LocalDispatcher:
+    """One dispatcher per server, shared by every thread extracting pages.
+
+    Keyed on the base URL rather than the client, so callers that create a
+    fresh client per page still share one dispatcher and its worker threads.
+    """
+    key = str(getattr(client, "base_url", "") or local_base_url()).rstrip("/")
+    with _dispatchers_lock:
+        dispatcher = _dispatchers.get(key)
+        if dispatcher is None:
+            dispatcher = LocalDispatcher(lambda messages: complete_local(client, messages))
+            _dispatchers[key] = dispatcher
+        return dispatcher
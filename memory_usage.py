@@ -0,0 +1,69 @@
+import logging
+import os
+import sys
+import threading
+from contextlib import contextmanager
+from typing import Dict
+
+logger = logging.getLogger(__name__)
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+_PAGE_SIZE = os.sysconf("SC_PAGE_SIZE") if hasattr(os, "sysconf") else 4096
+SAMPLE_INTERVAL = 0.05  # seconds between RSS samples inside track_memory
+
+
+def rss_bytes() -> int:
+    """Current resident set size of this process.
+
+    Falls back to the lifetime peak where /proc isn't available (macOS).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * _PAGE_SIZE
+    except (OSError, ValueError, IndexError):
+        return peak_rss_bytes()
+
+
+def peak_rss_bytes() -> int:
+    """Highest resident set size this process has reached"""
+    if resource is None:
+        return 0
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+@contextmanager
+def track_memory(label: str):
+    """Record RSS before and after a block and the highest RSS sampled during it.
+
+    RSS is sampled every SAMPLE_INTERVAL seconds on a background thread, so
+    the peak belongs to this block rather than to the process lifetime. It
+    is still process-wide: with concurrent pages it bounds what any one page
+    could have used rather than isolating it.
+    """
+    stats: Dict[str, int] = {"rss_start": rss_bytes()}
+    peak = [stats["rss_start"]]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(SAMPLE_INTERVAL):
+            peak[0] = max(peak[0], rss_bytes())
+
+    sampler = threading.Thread(target=sample, name="rss-sampler", daemon=True)
+    sampler.start()
+    try:
+        yield stats
+    finally:
+        stop.set()
+        sampler.join()
+        stats["rss_end"] = rss_bytes()
+        stats["peak_rss"] = max(peak[0], stats["rss_end"])
+        logger.info(
+            f"Memory for {label}: RSS {stats['rss_start'] / 2**20:.1f} -> {stats['rss_end'] / 2**20:.1f} MB, "
+            f"peak {stats['peak_rss'] / 2**20:.1f} MB"
+        )
@@ -0,0 +1,96 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from functools import lru_cache
+from typing import List, TYPE_CHECKING
+
+from assets import SYSTEM_MESSAGE, USER_MESSAGE
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+
+@dataclass(frozen=True)
+class PromptPrefix:
+    """The part of a prompt that is identical for every page of a job.
+
+    Providers cache (and local servers keep KV state for) the longest prompt
+    prefix they have seen before, so everything schema-dependent lives here,
+    byte for byte the same across pages, and page content only ever follows it.
+    """
+    system: str
+    user_prefix: str
+    cache_key: str
+
+    def messages(self, data: str) -> List[dict]:
+        return [
+            {"role": "system", "content": self.system},
+            {"role": "user", "content": self.user_prefix + data}
+        ]
+
+
+def schema_json(listing_model: "BaseModel") -> str:
+    return json.dumps(listing_model.model_json_schema())
+
+
+def generate_system_message(listing_model: "BaseModel") -> str:
+    return _schema_system_message(schema_json(listing_model))
+
+
+@lru_cache(maxsize=128)
+def _schema_system_message(schema: str) -> str:
+    schema_info = json.loads(schema)
+    field_descriptions = []
+    for field_name, field_info in schema_info["properties"].items():
+        field_type = field_info["type"]
+        field_descriptions.append(f'"{field_name}": "{field_type}"')
+    schema_structure = ",\n".join(field_descriptions)
+    system_message = f"""
+    You are an intelligent text extraction and conversion assistant. Your task is to extract structured information 
+                        from the given text and convert it into a pure JSON format. The JSON should contain only the structured data extracted from the text, 
+                        with no additional commentary, explanations, or extraneous information. 
+                        You could encounter cases where you can't find the data of the fields you have to extract or the data will be in a foreign language.
+                        Please process the following text and provide the output in pure JSON format with no words before or after the JSON:
+    Please ensure the output strictly follows this schema:
+
+    {{
+        "listings": [
+            {{
+                {schema_structure}
+            }}
+        ]
+    }} """
+    return system_message
+
+
+@lru_cache(maxsize=128)
+def _prompt_prefix(schema: str, schema_in_prompt: bool) -> PromptPrefix:
+    system = _schema_system_message(schema) if schema_in_prompt else SYSTEM_MESSAGE
+    # The schema is part of the request even when it's sent through the API
+    # rather than the system message, so it keys the cache either way
+    cache_key = "scraper-" + hashlib.sha1((schema + system + USER_MESSAGE).encode("utf-8")).hexdigest()[:16]
+    return PromptPrefix(system=system, user_prefix=USER_MESSAGE, cache_key=cache_key)
+
+
+def prompt_prefix(listing_model: "BaseModel", schema_in_prompt: bool) -> PromptPrefix:
+    """Stable prefix for a listing schema.
+
+    Models with native structured output get the schema through the API and
+    share the generic SYSTEM_MESSAGE; the others get the schema spelled out in
+    the system message.
+    """
+    return _prompt_prefix(schema_json(listing_model), schema_in_prompt)
+
+
+def cached_prompt_tokens(usage) -> int:
+    """Cached prompt tokens from an OpenAI-compatible or Gemini usage object, 0 if not reported"""
+    if usage is None:
+        return 0
+    details = getattr(usage, "prompt_tokens_details", None)
+    if isinstance(details, dict):
+        cached = details.get("cached_tokens")
+    else:
+        cached = getattr(details, "cached_tokens", None)
+    if cached is None:
+        cached = getattr(usage, "cached_content_token_count", None)
+    return int(cached or 0)
@@ -0,0 +1,170 @@
+import os
+import random
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlparse
+
+from assets import PROXY_SETTINGS
+from concurrency import ThrottledError
+
+# Errors that say something about the route rather than the page: httpx
+# transport errors, Selenium/Playwright network failures and throttling.
+# A 404 or an oversized page is the site's answer and doesn't count against a proxy
+PROXY_ERROR_NAMES = ("TransportError", "TimeoutException", "ConnectError", "ProxyError", "NetworkError")
+PROXY_ERROR_MESSAGES = ("net::ERR_", "ERR_PROXY", "ERR_CONNECTION", "ERR_TIMED_OUT")
+
+
+def is_proxy_error(error: BaseException) -> bool:
+    """Whether a failed request should count against the proxy it went through"""
+    if isinstance(error, (ThrottledError, TimeoutError, ConnectionError)):
+        return True
+    names = [cls.__name__ for cls in type(error).__mro__]
+    if any(name in PROXY_ERROR_NAMES or "Timeout" in name for name in names):
+        return True
+    message = str(error)
+    return any(marker in message for marker in PROXY_ERROR_MESSAGES)
+
+
+@dataclass
+class ProxyStats:
+    latency: Optional[float] = None
+    success_rate: float = 1.0
+    uses: int = 0
+    consecutive_failures: int = 0
+
+    def record(self, latency: float, ok: bool):
+        alpha = PROXY_SETTINGS["ewma_alpha"]
+        self.uses += 1
+        self.success_rate = (1 - alpha) * self.success_rate + alpha * (1.0 if ok else 0.0)
+        if ok:
+            self.latency = latency if self.latency is None else (1 - alpha) * self.latency + alpha * latency
+            self.consecutive_failures = 0
+        else:
+            self.consecutive_failures += 1
+
+
+@dataclass
+class Proxy:
+    url: str
+    stats: ProxyStats = field(default_factory=ProxyStats)
+    host_stats: Dict[str, ProxyStats] = field(default_factory=dict)
+    quarantined_until: float = 0.0
+
+    @property
+    def server(self) -> str:
+        parsed = urlparse(self.url)
+        return f"{parsed.scheme}://{parsed.hostname}:{parsed.port}" if parsed.port else f"{parsed.scheme}://{parsed.hostname}"
+
+    @property
+    def has_credentials(self) -> bool:
+        return bool(urlparse(self.url).username)
+
+    def playwright(self) -> dict:
+        """Proxy settings for browser.new_context(proxy=...)"""
+        parsed = urlparse(self.url)
+        settings = {"server": self.server}
+        if parsed.username:
+            settings["username"] = parsed.username
+            settings["password"] = parsed.password or ""
+        return settings
+
+    def is_healthy(self, now: float) -> bool:
+        return now >= self.quarantined_until
+
+    def score(self, host: str) -> float:
+        stats = self.host_stats.get(host)
+        if stats is None or stats.uses < PROXY_SETTINGS["min_host_samples"]:
+            stats = self.stats
+        # Untried proxies get an optimistic latency so they are explored
+        latency = stats.latency if stats.latency is not None else 0.5
+        return stats.success_rate / max(latency, 0.01)
+
+
+def normalize_proxy_url(value: str) -> str:
+    value = value.strip()
+    return value if "://" in value else f"http://{value}"
+
+
+def load_proxy_urls(env_var: str = PROXY_SETTINGS["env_var"], path: str = PROXY_SETTINGS["file"]) -> List[str]:
+    """Read the proxy pool from the environment or the proxy file"""
+    entries = [entry for entry in os.getenv(env_var, "").split(",") if entry.strip()]
+    if not entries and os.path.exists(path):
+        with open(path, 'r', encoding='utf-8') as f:
+            entries = [line for line in f if line.strip() and not line.lstrip().startswith("#")]
+    return [normalize_proxy_url(entry) for entry in entries]
+
+
+class ProxyManager:
+    """Routes requests through the fastest healthy proxies.
+
+    Tracks success rate and latency per proxy and per target host, benches
+    proxies after repeated failures, and keeps a host (or an explicit session
+    key) on the same proxy while it stays healthy.
+    """
+
+    def __init__(self, proxy_urls: Optional[List[str]] = None):
+        urls = load_proxy_urls() if proxy_urls is None else [normalize_proxy_url(url) for url in proxy_urls]
+        self.proxies = [Proxy(url) for url in dict.fromkeys(urls)]
+        self._sticky: Dict[str, Tuple[Proxy, float]] = {}
+        self._lock = threading.Lock()
+
+    def __bool__(self) -> bool:
+        return bool(self.proxies)
+
+    def choose(self, url: str, session: Optional[str] = None) -> Optional[Proxy]:
+        if not self.proxies:
+            return None
+        host = urlparse(url).netloc or url
+        key = session or host
+        now = time.time()
+        with self._lock:
+            sticky = self._sticky.get(key)
+            if sticky and sticky[0].is_healthy(now) and now - sticky[1] < PROXY_SETTINGS["sticky_ttl"]:
+                return sticky[0]
+            healthy = [proxy for proxy in self.proxies if proxy.is_healthy(now)]
+            if not healthy:
+                # Everything is benched: go with whichever proxy comes back first
+                healthy = [min(self.proxies, key=lambda proxy: proxy.quarantined_until)]
+            ranked = sorted(healthy, key=lambda proxy: proxy.score(host), reverse=True)
+            proxy = random.choice(ranked[:PROXY_SETTINGS["top_k"]])
+            self._sticky[key] = (proxy, now)
+            return proxy
+
+    def record(self, proxy: Proxy, url: str, latency: float, ok: bool):
+        host = urlparse(url).netloc or url
+        with self._lock:
+            proxy.stats.record(latency, ok)
+            proxy.host_stats.setdefault(host, ProxyStats()).record(latency, ok)
+            if proxy.stats.consecutive_failures >= PROXY_SETTINGS["quarantine_after"]:
+                proxy.quarantined_until = time.time() + PROXY_SETTINGS["quarantine_seconds"]
+                proxy.stats.consecutive_failures = 0
+                self._sticky = {key: value for key, value in self._sticky.items() if value[0] is not proxy}
+
+    @contextmanager
+    def use(self, url: str, session: Optional[str] = None):
+        """Yield a proxy (or None when the pool is empty) and record how the request went"""
+        proxy = self.choose(url, session)
+        start = time.monotonic()
+        try:
+            yield proxy
+        except BaseException as e:
+            if proxy is not None:
+                self.record(proxy, url, time.monotonic() - start, not is_proxy_error(e))
+            raise
+        if proxy is not None:
+            self.record(proxy, url, time.monotonic() - start, True)
+
+
+_default_manager: Optional[ProxyManager] = None
+_default_lock = threading.Lock()
+
+
+def get_proxy_manager() -> ProxyManager:
+    global _default_manager
+    with _default_lock:
+        if _default_manager is None:
+            _default_manager = ProxyManager()
+        return _default_manager
@@ -3,117 +3,175 @@ import random
 import time
 import re
 import json
+import importlib.util
 from datetime import datetime
-from typing import List, Dict, Type, Optional
-from concurrent.futures import ThreadPoolExecutor
-from functools import lru_cache
+from typing import List, Dict, Type, Optional, TYPE_CHECKING
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed
+from functools import wraps
 import logging
-
-import pandas as pd
-from bs4 import BeautifulSoup
-from pydantic import BaseModel, Field, create_model
-import html2text
-import tiktoken
+import queue
+import threading
+from urllib.parse import urlparse
 
 from dotenv import load_dotenv
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.common.action_chains import ActionChains
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-
-from openai import OpenAI
-import google.generativeai as genai
-from groq import Groq
-
-import httpx
-from urllib3.util.retry import Retry
-from tenacity import retry, stop_after_attempt, wait_exponential
-
-from webdriver_manager.chrome import ChromeDriverManager
 
 # Import all necessary constants first
 from assets import (
     USER_AGENTS, 
     PRICING, 
     HEADLESS_OPTIONS, 
-    SYSTEM_MESSAGE, 
-    USER_MESSAGE, 
-    LLAMA_MODEL_FULLNAME, 
     GROQ_LLAMA_MODEL_FULLNAME,
     PROGRESS_LOG_FILE,
     REQUEST_SETTINGS,
-    MAX_WORKERS,
     RETRY_SETTINGS,
     RATE_LIMIT,
+    CONCURRENCY_SETTINGS,
+    STRUCTURED_DATA_SETTINGS,
+    DEDUP_SETTINGS,
+    SESSION_STATE_SETTINGS,
+    LOCAL_LLM_SETTINGS,
+    PAGE_SETTINGS,
+    BROWSER_POOL_SIZE,
+    ACCEPT_COOKIES_SCRIPT,
     Config
 )
+from concurrency import ThrottledError, get_controller, parse_retry_after, retry_delay
+from structured_data import join_key, join_value, select_listings, structured_groups
+from session_state import get_session_store, local_storage_script, selenium_cookies_to_state
+from proxies import get_proxy_manager
+from dedup import get_deduplicator
+from prompts import cached_prompt_tokens, prompt_prefix
+from local_llm import complete_local, get_local_dispatcher, local_base_url
+from memory_usage import track_memory
+from tracing import activate_trace, current_trace, har_path, profile_cpu, span, trace_url
+
+if TYPE_CHECKING:
+    from pydantic import BaseModel
+
+# Heavy dependencies (pandas, bs4, html2text, tiktoken, browser drivers and
+# provider SDKs) are imported inside the functions that use them so that
+# importing this module stays cheap for short-lived workers and Streamlit reruns.
 
 load_dotenv()
 
-# Optional import for Playwright
-try:
-    from playwright.sync_api import sync_playwright
-    PLAYWRIGHT_AVAILABLE = True
-except ImportError:
-    PLAYWRIGHT_AVAILABLE = False
-    print("Playwright not installed. Dynamic content fetching will use Selenium fallback.")
-
-# Configure logging after importing PROGRESS_LOG_FILE
-logging.basicConfig(
-    filename=PROGRESS_LOG_FILE,
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+# Playwright is optional; only check that it is installed, import it on first use
+PLAYWRIGHT_AVAILABLE = importlib.util.find_spec("playwright") is not None
 
 logger = logging.getLogger(__name__)
 
+def configure_logging(log_file: str = PROGRESS_LOG_FILE):
+    """Send progress logs to the log file, called by entry points rather than on import"""
+    logging.basicConfig(
+        filename=log_file,
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+def retry_on_failure(func):
+    """Retry with RETRY_SETTINGS backoff (honoring Retry-After), loading tenacity on the first call"""
+    retrying = None
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        nonlocal retrying
+        if retrying is None:
+            from tenacity import retry, stop_after_attempt
+            retrying = retry(
+                stop=stop_after_attempt(RETRY_SETTINGS["max_retries"]),
+                wait=lambda state: retry_delay(state.attempt_number, state.outcome.exception()),
+                reraise=True
+            )(func)
+        return retrying(*args, **kwargs)
+    return wrapper
+
+URL_PATTERN = re.compile(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+')
+
+class PageTooLargeError(ValueError):
+    pass
+
+def cap_html(html: Optional[str], url: str = "") -> Optional[str]:
+    """Bound an already-rendered page to PAGE_SETTINGS['max_bytes'] characters"""
+    limit = PAGE_SETTINGS["max_bytes"]
+    if html is None or len(html) <= limit:
+        return html
+    if not PAGE_SETTINGS["truncate"]:
+        raise PageTooLargeError(f"{url} is larger than {limit} characters")
+    logging.warning(f"Truncating {url} from {len(html)} to {limit} characters")
+    return html[:limit]
+
+def read_capped(response, url: str = "") -> str:
+    """Read a streamed httpx response, stopping at PAGE_SETTINGS['max_bytes']"""
+    limit = PAGE_SETTINGS["max_bytes"]
+    declared = response.headers.get("Content-Length")
+    if declared and declared.isdigit() and int(declared) > limit and not PAGE_SETTINGS["truncate"]:
+        raise PageTooLargeError(f"{url} declares {declared} bytes, limit is {limit}")
+    body = bytearray()
+    for chunk in response.iter_bytes(chunk_size=PAGE_SETTINGS["chunk_size"]):
+        room = limit - len(body)
+        if len(chunk) > room:
+            if not PAGE_SETTINGS["truncate"]:
+                raise PageTooLargeError(f"{url} is larger than {limit} bytes")
+            body += chunk[:room]
+            logging.warning(f"Truncated {url} at {limit} bytes")
+            break
+        body += chunk
+    return body.decode(response.encoding or "utf-8", errors="replace")
+
 class OptimizedScraper:
-    def __init__(self):
-        self.client = httpx.Client()
+    def __init__(self, proxy_manager=None):
+        from urllib3.util.retry import Retry
+
+        self.proxy_manager = proxy_manager or get_proxy_manager()
+        self.client = self._client_for(None)
+        self._proxy_clients = {}
         self.retry_strategy = Retry(
             total=REQUEST_SETTINGS["max_retries"],
             backoff_factor=REQUEST_SETTINGS["backoff_factor"],
             status_forcelist=REQUEST_SETTINGS["status_forcelist"]
         )
         
+    @staticmethod
+    def _client_for(proxy):
+        import httpx
+
+        if proxy is None:
+            return httpx.Client()
+        try:
+            return httpx.Client(proxy=proxy.url)
+        except TypeError:
+            # httpx < 0.26 only knows the plural argument
+            return httpx.Client(proxies=proxy.url)
+
     def fetch_with_retry(self, url):
         try:
-            response = self.client.get(
-                url, 
-                timeout=REQUEST_SETTINGS["timeout"],
-                follow_redirects=True
-            )
-            response.raise_for_status()
-            return response.text
+            with self.proxy_manager.use(url) as proxy:
+                if proxy is None:
+                    client = self.client
+                else:
+                    client = self._proxy_clients.get(proxy.url)
+                    if client is None:
+                        client = self._proxy_clients.setdefault(proxy.url, self._client_for(proxy))
+                # Streamed so an oversized page never sits fully in memory
+                with client.stream(
+                    "GET",
+                    url, 
+                    timeout=REQUEST_SETTINGS["timeout"],
+                    follow_redirects=True
+                ) as response:
+                    if response.status_code in CONCURRENCY_SETTINGS["throttle_statuses"]:
+                        raise ThrottledError(url, response.status_code, parse_retry_after(response.headers.get("Retry-After")))
+                    response.raise_for_status()
+                    return read_capped(response, url)
         except Exception as e:
             logging.error(f"Error fetching {url}: {str(e)}")
             raise
 
-@lru_cache(maxsize=100)
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def fetch_html_selenium(url: str) -> str:
-    max_retries = RETRY_SETTINGS["max_retries"]
-    base_delay = RETRY_SETTINGS["base_delay"]
-    exponential_base = RETRY_SETTINGS["exponential_base"]
-    
-    for attempt in range(max_retries):
-        try:
-            driver = setup_selenium()
-            driver.get(url)
-            time.sleep(2)
-            html = driver.page_source
-            driver.quit()
-            return html
-        except Exception as e:
-            if attempt == max_retries - 1:
-                raise e
-            delay = min(base_delay * (exponential_base ** attempt), RETRY_SETTINGS["max_delay"])
-            time.sleep(delay)
+def setup_selenium(proxy=None):
+    from selenium import webdriver
+    from selenium.webdriver.chrome.service import Service
+    from selenium.webdriver.chrome.options import Options
+    from webdriver_manager.chrome import ChromeDriverManager
 
-def setup_selenium():
     options = Options()
     user_agent = random.choice(USER_AGENTS)
     options.add_argument(f"user-agent={user_agent}")
@@ -122,6 +180,10 @@ def setup_selenium():
     options.add_argument("--headless")  # Run in headless mode
     options.add_argument("--no-sandbox")  # Bypass OS security model
     options.add_argument("--disable-dev-shm-usage")  # Overcome limited resource problems
+    if proxy is not None:
+        if proxy.has_credentials:
+            logger.warning("Chrome's --proxy-server ignores credentials, use an IP-allowlisted proxy with Selenium")
+        options.add_argument(f"--proxy-server={proxy.server}")
     
     try:
         # Try using webdriver_manager first
@@ -140,21 +202,35 @@ def setup_selenium():
     driver.set_page_load_timeout(Config.SELENIUM_TIMEOUT)
     return driver
 
-def batch_scrape(urls: List[str], max_workers: int = MAX_WORKERS) -> List[str]:
-    with ThreadPoolExecutor(max_workers=max_workers) as executor:
-        results = list(executor.map(fetch_html_selenium, urls))
+def controlled_fetch(url: str, fetch=None, controller=None) -> str:
+    """Fetch through the adaptive concurrency controller, retrying with its backoff.
+
+    This is the only retry layer: `fetch` must not retry itself (use
+    fetch_html(..., retry=False)), otherwise backoff sleeps hold a slot.
+    """
+    fetch = fetch or fetch_html_selenium.__wrapped__
+    controller = controller or get_controller()
+
+    @retry_on_failure
+    def attempt():
+        with controller.slot(url):
+            return fetch(url)
+    return attempt()
+
+def batch_scrape(urls: List[str], max_workers: Optional[int] = None, controller=None) -> List[str]:
+    controller = controller or get_controller()
+    with ThreadPoolExecutor(max_workers=max_workers or controller.max_workers) as executor:
+        results = list(executor.map(lambda url: controlled_fetch(url, controller=controller), urls))
     return results
 
 def clean_memory():
     import gc
     gc.collect()
 
-def get_random_proxy() -> str:
-    PROXY_LIST = [
-        "proxy1:port",
-        "proxy2:port"
-    ]
-    return random.choice(PROXY_LIST)
+def get_random_proxy() -> Optional[str]:
+    """Best proxy for an arbitrary request, or None when no pool is configured"""
+    proxy = get_proxy_manager().choose("*")
+    return proxy.url if proxy else None
 
 def validate_content(html_content: str) -> str:
     if not html_content or len(html_content) < 100:
@@ -162,39 +238,74 @@ def validate_content(html_content: str) -> str:
     return html_content
 
 def click_accept_cookies(driver):
+    """Dismiss a cookie banner with one in-page script instead of a wait plus XPath probes"""
     try:
-        WebDriverWait(driver, 10).until(
-            EC.presence_of_element_located((By.XPATH, "//button | //a | //div"))
-        )
-        
-        accept_text_variations = [
-            "accept", "agree", "allow", "consent", "continue", "ok", "I agree", "got it"
-        ]
-        
-        for tag in ["button", "a", "div"]:
-            for text in accept_text_variations:
-                try:
-                    element = driver.find_element(By.XPATH, f"//{tag}[contains(translate(text(), 'ABCDEFGHIJKLMNOPQRSTUVWXYZ', 'abcdefghijklmnopqrstuvwxyz'), '{text}')]")
-                    if element:
-                        element.click()
-                        print(f"Clicked the '{text}' button.")
-                        return
-                except:
-                    continue
-
-        print("No 'Accept Cookies' button found.")
-    
+        clicked = driver.execute_script(ACCEPT_COOKIES_SCRIPT)
+        if clicked:
+            logging.info(f"Clicked the '{clicked}' button.")
+        return clicked
     except Exception as e:
-        print(f"Error finding 'Accept Cookies' button: {e}")
+        logging.warning(f"Error dismissing cookie banner: {e}")
+        return None
+
+def accept_cookies_playwright(page):
+    """Playwright counterpart of click_accept_cookies"""
+    try:
+        clicked = page.evaluate("() => {" + ACCEPT_COOKIES_SCRIPT + "}")
+        if clicked:
+            logging.info(f"Clicked the '{clicked}' button.")
+        return clicked
+    except Exception as e:
+        logging.warning(f"Error dismissing cookie banner: {e}")
+        return None
+
+def restore_selenium_session(driver, state: dict):
+    """Load saved cookies and localStorage into Chrome before the first navigation"""
+    driver.execute_cdp_cmd("Network.enable", {})
+    cookies = [{key: value for key, value in cookie.items() if not (key == "expires" and value <= 0)}
+               for cookie in state.get("cookies", [])]
+    if cookies:
+        driver.execute_cdp_cmd("Network.setCookies", {"cookies": cookies})
+    if state.get("origins"):
+        driver.execute_cdp_cmd("Page.addScriptToEvaluateOnNewDocument", {"source": local_storage_script(state)})
+
+def capture_selenium_session(driver, url: str) -> dict:
+    origin = "{0.scheme}://{0.netloc}".format(urlparse(driver.current_url or url))
+    local_storage = driver.execute_script("return Object.assign({}, window.localStorage);") or {}
+    return selenium_cookies_to_state(driver.get_cookies(), origin, local_storage)
+
+def new_playwright_context(browser, url: str, proxy=None):
+    """Open a context seeded with the domain's saved session state, if any"""
+    state = get_session_store().get(url) if SESSION_STATE_SETTINGS["enabled"] else None
+    options = {"storage_state": state, "proxy": proxy.playwright() if proxy else None}
+    har = har_path()
+    if har:
+        # Written when the context closes; carries per-request network timing
+        options["record_har_path"] = har
+    return browser.new_context(**options), state is not None
+
+def finish_playwright_session(context, page, url: str, restored: bool):
+    """On the first visit to a domain, dismiss consent once and remember the resulting state"""
+    if restored or not SESSION_STATE_SETTINGS["enabled"]:
+        return
+    if not accept_cookies_playwright(page):
+        return
+    try:
+        # Let the consent request and cookie writes land before snapshotting them
+        page.wait_for_load_state("networkidle", timeout=SESSION_STATE_SETTINGS["consent_settle"] * 1000)
+    except Exception:
+        pass
+    get_session_store().save(url, context.storage_state())
 
 def fetch_dynamic_content(url):
     if (PLAYWRIGHT_AVAILABLE):
+        from playwright.sync_api import sync_playwright
         try:
             with sync_playwright() as p:
                 browser = p.chromium.launch()
                 page = browser.new_page()
                 page.goto(url, wait_until="networkidle")
-                content = page.content()
+                content = cap_html(page.content(), url)
                 browser.close()
                 return content
         except Exception as e:
@@ -204,12 +315,15 @@ def fetch_dynamic_content(url):
         return fetch_html_selenium(url)
 
 def parallel_scrape(urls):
+    from tqdm import tqdm
+
     results = []
-    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as executor:
-        future_to_url = {executor.submit(fetch_html_selenium, url): url for url in urls}
+    controller = get_controller()
+    with ThreadPoolExecutor(max_workers=controller.max_workers) as executor:
+        future_to_url = {executor.submit(controlled_fetch, url, controller=controller): url for url in urls}
         
         with tqdm(total=len(urls), desc="Scraping Progress") as pbar:
-            for future in concurrent.futures.as_completed(future_to_url):
+            for future in as_completed(future_to_url):
                 url = future_to_url[future]
                 try:
                     data = future.result()
@@ -220,50 +334,99 @@ def parallel_scrape(urls):
     
     return results
 
-def fetch_html_selenium(url):
-    driver = setup_selenium()
+@retry_on_failure
+def fetch_html_selenium(url: str) -> str:
+    """Fetch HTML content using Selenium, scrolling to trigger lazy-loaded content"""
+    with get_proxy_manager().use(url) as proxy:
+        return _fetch_html_selenium(url, proxy)
+
+def _fetch_html_selenium(url: str, proxy=None) -> str:
+    with span("selenium.setup"):
+        driver = setup_selenium(proxy)
     try:
-        driver.get(url)
+        state = get_session_store().get(url) if SESSION_STATE_SETTINGS["enabled"] else None
+        if state:
+            restore_selenium_session(driver, state)
+        with span("selenium.get"):
+            driver.get(url)
         
-        time.sleep(1)
+        with span("selenium.sleep", seconds=1):
+            time.sleep(1)
         driver.maximize_window()
+        if SESSION_STATE_SETTINGS["enabled"] and not state:
+            with span("selenium.consent"):
+                if click_accept_cookies(driver):
+                    time.sleep(SESSION_STATE_SETTINGS["consent_settle"])
+                    get_session_store().save(url, capture_selenium_session(driver, url))
         
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(2)
-        driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
-        time.sleep(1)
-        html = driver.page_source
+        with span("selenium.scroll", seconds=3):
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            time.sleep(2)
+            driver.execute_script("window.scrollTo(0, document.body.scrollHeight);")
+            time.sleep(1)
+        with span("selenium.page_source"):
+            html = cap_html(driver.page_source, url)
         return html
     finally:
-        driver.quit()
+        with span("selenium.quit"):
+            driver.quit()
 
 def clean_html(html_content):
+    return _clean_html(html_content)[0]
+
+def _clean_html(html_content, collect_structured: bool = False):
+    """Strip page furniture; optionally collect structured-data sources from the same parse"""
+    from bs4 import BeautifulSoup
+
+    groups = {}
     try:
-        soup = BeautifulSoup(html_content, 'html.parser')
-        
+        with span("clean_html.parse"):
+            soup = BeautifulSoup(html_content, 'html.parser')
+        if collect_structured:
+            # JSON-LD lives in script tags, so read it before they're stripped
+            try:
+                with span("structured_data.collect"):
+                    groups = structured_groups(soup)
+            except Exception as e:
+                logging.warning(f"Structured data extraction failed: {str(e)}")
+
         for element in soup.find_all(['script', 'style', 'iframe', 'header', 'footer']):
             element.decompose()
-            
-        for element in soup.find_all(class_=True):
-            try:
-                element.attrs['class'] = ' '.join(element.attrs['class'])
-            except (KeyError, TypeError):
-                continue
-                
-        return str(soup)
+        # str() already renders multi-valued class attributes joined, and
+        # decomposing frees the tree now instead of whenever gc gets to it
+        cleaned_html = str(soup)
+        soup.decompose()
+        return cleaned_html, groups
     except Exception as e:
         logging.error(f"Error cleaning HTML: {str(e)}")
-        return html_content
+        return html_content, groups
+
+def _cleaned_to_markdown(cleaned_html, strip_urls: bool = False):
+    import html2text
 
-def html_to_markdown_with_readability(html_content):
-    cleaned_html = clean_html(html_content)  
-    
     markdown_converter = html2text.HTML2Text()
-    markdown_converter.ignore_links = False
-    markdown_content = markdown_converter.handle(cleaned_html)
-    
+    markdown_converter.ignore_links = strip_urls
+    with profile_cpu("html2text"):
+        markdown_content = markdown_converter.handle(cleaned_html)
+    if strip_urls:
+        markdown_content = URL_PATTERN.sub('', markdown_content)
     return markdown_content
 
+def html_to_markdown_with_readability(html_content, strip_urls: bool = False):
+    with profile_cpu("clean_html"):
+        cleaned_html = clean_html(html_content)
+    return _cleaned_to_markdown(cleaned_html, strip_urls)
+
+def page_markdown(html_content, strip_urls: bool = False):
+    """Markdown for a page plus its structured-data sources, from a single parse.
+
+    Returns (markdown, structured) where structured is what format_page expects;
+    the raw HTML isn't needed after this.
+    """
+    with profile_cpu("clean_html"):
+        cleaned_html, structured = _clean_html(html_content, collect_structured=STRUCTURED_DATA_SETTINGS["enabled"])
+    return _cleaned_to_markdown(cleaned_html, strip_urls), structured
+
 def save_raw_data(raw_data: str, timestamp: str | None = None, output_folder: str = 'output') -> tuple[str, str]:
     if timestamp is None:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
@@ -278,25 +441,31 @@ def save_raw_data(raw_data: str, timestamp: str | None = None, output_folder: st
     return raw_output_path, timestamp
 
 def remove_urls_from_file(file_path):
-    url_pattern = r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+'
+    """Write a URL-free copy of a saved file; prefer html_to_markdown_with_readability(strip_urls=True)"""
     base, ext = os.path.splitext(file_path)
     new_file_path = f"{base}_cleaned{ext}"
     with open(file_path, 'r', encoding='utf-8') as file:
         markdown_content = file.read()
-    cleaned_content = re.sub(url_pattern, '', markdown_content)
+    cleaned_content = URL_PATTERN.sub('', markdown_content)
     with open(new_file_path, 'w', encoding='utf-8') as file:
         file.write(cleaned_content)
     print(f"Cleaned file saved as: {new_file_path}")
     return cleaned_content
 
-def create_dynamic_listing_model(field_names: List[str]) -> Type[BaseModel]:
+def create_dynamic_listing_model(field_names: List[str]) -> Type["BaseModel"]:
+    from pydantic import create_model
+
     field_definitions = {field: (str, ...) for field in field_names}
     return create_model('DynamicListingModel', **field_definitions)
 
-def create_listings_container_model(listing_model: Type[BaseModel]) -> Type[BaseModel]:
+def create_listings_container_model(listing_model: Type["BaseModel"]) -> Type["BaseModel"]:
+    from pydantic import create_model
+
     return create_model('DynamicListingsContainer', listings=(List[listing_model], ...))
 
 def trim_to_token_limit(text, model, max_tokens=120000):
+    import tiktoken
+
     encoder = tiktoken.encoding_for_model(model)
     tokens = encoder.encode(text)
     if len(tokens) > max_tokens:
@@ -304,118 +473,183 @@ def trim_to_token_limit(text, model, max_tokens=120000):
         return trimmed_text
     return text
 
-def generate_system_message(listing_model: BaseModel) -> str:
-    schema_info = listing_model.model_json_schema()
-    field_descriptions = []
-    for field_name, field_info in schema_info["properties"].items():
-        field_type = field_info["type"]
-        field_descriptions.append(f'"{field_name}": "{field_type}"')
-    schema_structure = ",\n".join(field_descriptions)
-    system_message = f"""
-    You are an intelligent text extraction and conversion assistant. Your task is to extract structured information 
-                        from the given text and convert it into a pure JSON format. The JSON should contain only the structured data extracted from the text, 
-                        with no additional commentary, explanations, or extraneous information. 
-                        You could encounter cases where you can't find the data of the fields you have to extract or the data will be in a foreign language.
-                        Please process the following text and provide the output in pure JSON format with no words before or after the JSON:
-    Please ensure the output strictly follows this schema:
-
-    {{
-        "listings": [
-            {{
-                {schema_structure}
-            }}
-        ]
-    }} """
-    return system_message
+def create_llm_client(selected_model):
+    """Build the provider client for a model so callers can reuse it across pages"""
+    if selected_model in ["gpt-4o-mini", "gpt-4o-2024-08-06"]:
+        from openai import OpenAI
+        return OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+    elif selected_model == "gemini-1.5-flash":
+        import google.generativeai as genai
+        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
+        return genai
+    elif selected_model == "Llama3.1 8B":
+        from openai import OpenAI
+        return OpenAI(base_url=local_base_url(), api_key="lm-studio")
+    elif selected_model == "Groq Llama3.1 70b":
+        from groq import Groq
+        return Groq(api_key=os.environ.get("GROQ_API_KEY"),)
+    else:
+        raise ValueError(f"Unsupported model: {selected_model}")
 
-def format_data(data, DynamicListingsContainer, DynamicListingModel, selected_model):
+def format_data(data, DynamicListingsContainer, DynamicListingModel, selected_model, client=None):
     token_counts = {}
+    if client is None:
+        client = create_llm_client(selected_model)
     
     if selected_model in ["gpt-4o-mini", "gpt-4o-2024-08-06"]:
-        client = OpenAI(api_key=os.getenv('OPENAI_API_KEY'))
+        prefix = prompt_prefix(DynamicListingModel, schema_in_prompt=False)
         completion = client.beta.chat.completions.parse(
             model=selected_model,
-            messages=[
-                {"role": "system", "content": SYSTEM_MESSAGE},
-                {"role": "user", "content": USER_MESSAGE + data},
-            ],
-            response_format=DynamicListingsContainer
+            messages=prefix.messages(data),
+            response_format=DynamicListingsContainer,
+            # Routes requests sharing this prefix to the same prompt cache
+            extra_body={"prompt_cache_key": prefix.cache_key}
         )
-        encoder = tiktoken.encoding_for_model(selected_model)
-        input_token_count = len(encoder.encode(USER_MESSAGE + data))
-        output_token_count = len(encoder.encode(json.dumps(completion.choices[0].message.parsed.dict())))
         token_counts = {
-            "input_tokens": input_token_count,
-            "output_tokens": output_token_count
+            "input_tokens": completion.usage.prompt_tokens,
+            "output_tokens": completion.usage.completion_tokens,
+            "cached_input_tokens": cached_prompt_tokens(completion.usage)
         }
         return completion.choices[0].message.parsed, token_counts
 
     elif selected_model == "gemini-1.5-flash":
-        genai.configure(api_key=os.getenv("GOOGLE_API_KEY"))
-        model = genai.GenerativeModel('gemini-1.5-flash',
+        prefix = prompt_prefix(DynamicListingModel, schema_in_prompt=False)
+        # The system instruction stays out of the page content so the prefix is stable
+        model = client.GenerativeModel('gemini-1.5-flash',
+                system_instruction=prefix.system,
                 generation_config={
                     "response_mime_type": "application/json",
                     "response_schema": DynamicListingsContainer
                 })
-        prompt = SYSTEM_MESSAGE + "\n" + USER_MESSAGE + data
-        input_tokens = model.count_tokens(prompt)
-        completion = model.generate_content(prompt)
+        completion = model.generate_content(prefix.user_prefix + data)
         usage_metadata = completion.usage_metadata
         token_counts = {
             "input_tokens": usage_metadata.prompt_token_count,
-            "output_tokens": usage_metadata.candidates_token_count
+            "output_tokens": usage_metadata.candidates_token_count,
+            "cached_input_tokens": cached_prompt_tokens(usage_metadata)
         }
         return completion.text, token_counts
     
     elif selected_model == "Llama3.1 8B":
-        sys_message = generate_system_message(DynamicListingModel)
-        client = OpenAI(base_url="http://localhost:1234/v1", api_key="lm-studio")
-        completion = client.chat.completions.create(
-            model=LLAMA_MODEL_FULLNAME,
-            messages=[
-                {"role": "system", "content": sys_message},
-                {"role": "user", "content": USER_MESSAGE + data}
-            ],
-            temperature=0.7,
-            
-        )
+        prefix = prompt_prefix(DynamicListingModel, schema_in_prompt=True)
+        if LOCAL_LLM_SETTINGS["dispatch"]:
+            # Pages extracted concurrently share the server's slots instead of each opening its own
+            completion = get_local_dispatcher(client).submit(prefix.messages(data)).result()
+        else:
+            completion = complete_local(client, prefix.messages(data))
         response_content = completion.choices[0].message.content
-        print(response_content)
+        logger.debug(response_content)
         parsed_response = json.loads(response_content)
         token_counts = {
             "input_tokens": completion.usage.prompt_tokens,
-            "output_tokens": completion.usage.completion_tokens
+            "output_tokens": completion.usage.completion_tokens,
+            "cached_input_tokens": cached_prompt_tokens(completion.usage)
         }
         return parsed_response, token_counts
     elif selected_model== "Groq Llama3.1 70b":
-        sys_message = generate_system_message(DynamicListingModel)
-        client = Groq(api_key=os.environ.get("GROQ_API_KEY"),)
+        prefix = prompt_prefix(DynamicListingModel, schema_in_prompt=True)
         completion = client.chat.completions.create(
-        messages=[
-            {"role": "system","content": sys_message},
-            {"role": "user","content": USER_MESSAGE + data}
-        ],
+        messages=prefix.messages(data),
         model=GROQ_LLAMA_MODEL_FULLNAME,
     )
         response_content = completion.choices[0].message.content
         parsed_response = json.loads(response_content)
         token_counts = {
             "input_tokens": completion.usage.prompt_tokens,
-            "output_tokens": completion.usage.completion_tokens
+            "output_tokens": completion.usage.completion_tokens,
+            "cached_input_tokens": cached_prompt_tokens(completion.usage)
         }
         return parsed_response, token_counts
     else:
         raise ValueError(f"Unsupported model: {selected_model}")
 
-def save_formatted_data(formatted_data, timestamp, output_folder='output'):
-    os.makedirs(output_folder, exist_ok=True)
+def normalize_formatted_data(formatted_data):
+    """Turn whatever format_data returned (model, JSON string or dict) into plain Python data"""
     if isinstance(formatted_data, str):
         try:
-            formatted_data_dict = json.loads(formatted_data)
+            return json.loads(formatted_data)
         except json.JSONDecodeError:
             raise ValueError("The provided formatted data is a string but not valid JSON.")
+    return formatted_data.dict() if hasattr(formatted_data, 'dict') else formatted_data
+
+def extract_listings(formatted_data) -> List[dict]:
+    """Return the listing rows contained in a format_data result"""
+    formatted_data_dict = normalize_formatted_data(formatted_data)
+    if isinstance(formatted_data_dict, dict):
+        rows = next(iter(formatted_data_dict.values())) if len(formatted_data_dict) == 1 else [formatted_data_dict]
+    elif isinstance(formatted_data_dict, list):
+        rows = formatted_data_dict
     else:
-        formatted_data_dict = formatted_data.dict() if hasattr(formatted_data, 'dict') else formatted_data
+        raise ValueError("Formatted data is neither a dictionary nor a list, cannot extract listings")
+    return list(rows)
+
+def format_page(structured: Dict[str, List[dict]], markdown: str, field_names: List[str], selected_model: str, client=None):
+    """Extract listings for one page, reading embedded structured data before calling the LLM.
+
+    `structured` comes from page_markdown. When JSON-LD, microdata or tables
+    cover every field the LLM is skipped; when they cover some and a covered
+    field identifies each row, the LLM is asked only for the missing fields
+    and the rows are joined on it.
+    Returns ({"listings": rows}, token_counts) like format_data.
+    """
+    rows, covered = [], []
+    if structured:
+        with span("structured_data.select"):
+            rows, covered = select_listings(structured, field_names)
+    missing = [field for field in field_names if field not in covered]
+    if rows and not missing:
+        logging.info(f"Structured data covered all fields for {len(rows)} listings, skipping the LLM")
+        return {"listings": rows}, {"input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0}
+
+    def run_llm(fields):
+        DynamicListingModel = create_dynamic_listing_model(fields)
+        DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
+        with span("format_data", model=selected_model, fields=len(fields)):
+            formatted_data, token_counts = format_data(markdown, DynamicListingsContainer, DynamicListingModel, selected_model, client=client)
+        return extract_listings(formatted_data), token_counts
+
+    key = join_key(rows, covered) if rows and covered else None
+    if key is None:
+        llm_rows, token_counts = run_llm(field_names)
+        return {"listings": llm_rows}, token_counts
+
+    llm_rows, token_counts = run_llm([key] + missing)
+    by_key = {join_value(llm_row.get(key, "")): llm_row for llm_row in llm_rows}
+    merged, joined = [], 0
+    for row in rows:
+        llm_row = by_key.get(join_value(row[key]))
+        joined += llm_row is not None
+        merged.append({field: (llm_row or {}).get(field, "") if field in missing else row[field] for field in field_names})
+    logging.info(f"Joined {joined} of {len(rows)} structured listings with LLM fields on '{key}'")
+    return {"listings": merged}, token_counts
+
+def dedupe_listings(formatted_data, deduplicator=None) -> dict:
+    """Drop listings already seen on earlier pages or runs.
+
+    The kept listings are only remembered once the caller commits the
+    deduplicator, so call commit() after saving them (or rollback()).
+    """
+    deduplicator = deduplicator or get_deduplicator()
+    listings, stats = deduplicator.filter(extract_listings(formatted_data))
+    logging.info(f"De-duplication kept {stats['kept']} listings ({stats['near']} possible near duplicates), dropped {stats['exact']} exact duplicates")
+    return {"listings": listings}
+
+def save_formatted_data(formatted_data, timestamp, output_folder='output', deduplicator=None):
+    if deduplicator is None:
+        return _write_formatted_data(formatted_data, timestamp, output_folder)
+    formatted_data = dedupe_listings(formatted_data, deduplicator)
+    try:
+        df = _write_formatted_data(formatted_data, timestamp, output_folder)
+    except BaseException:
+        # Nothing was saved, so these listings mustn't count as seen on later runs
+        deduplicator.rollback()
+        raise
+    deduplicator.commit()
+    return df
+
+def _write_formatted_data(formatted_data, timestamp, output_folder='output'):
+    os.makedirs(output_folder, exist_ok=True)
+    formatted_data_dict = normalize_formatted_data(formatted_data)
     json_output_path = os.path.join(output_folder, f'sorted_data_{timestamp}.json')
     with open(json_output_path, 'w', encoding='utf-8') as f:
         json.dump(formatted_data_dict, f, indent=4)
@@ -427,6 +661,7 @@ def save_formatted_data(formatted_data, timestamp, output_folder='output'):
     else:
         raise ValueError("Formatted data is neither a dictionary nor a list, cannot convert to DataFrame")
     try:
+        import pandas as pd
         df = pd.DataFrame(data_for_df)
         print("DataFrame created successfully.")
         excel_output_path = os.path.join(output_folder, f'sorted_data_{timestamp}.xlsx')
@@ -439,61 +674,192 @@ def save_formatted_data(formatted_data, timestamp, output_folder='output'):
 
 def calculate_price(tokens_count: dict, model: str) -> tuple[float, float, float]:
     model_config = PRICING[model]
-    input_cost = tokens_count['input_tokens'] * model_config.input_price
+    cached_tokens = tokens_count.get('cached_input_tokens', 0)
+    cached_price = model_config.input_price if model_config.cached_input_price is None else model_config.cached_input_price
+    input_cost = (tokens_count['input_tokens'] - cached_tokens) * model_config.input_price + cached_tokens * cached_price
     output_cost = tokens_count['output_tokens'] * model_config.output_price
     total_cost = input_cost + output_cost
     return input_cost, output_cost, total_cost
 
 __all__ = ['fetch_html', 'save_raw_data', 'format_data', 'save_formatted_data', 
-           'calculate_price', 'html_to_markdown_with_readability', 
-           'create_dynamic_listing_model', 'create_listings_container_model']
+           'calculate_price', 'html_to_markdown_with_readability', 'page_markdown', 
+           'create_dynamic_listing_model', 'create_listings_container_model',
+           'create_llm_client', 'extract_listings', 'format_page', 'dedupe_listings', 'BrowserPool']
+
+def check_throttled(url: str, response):
+    """Raise ThrottledError when a Playwright navigation answered with a throttling status"""
+    if response is not None and response.status in CONCURRENCY_SETTINGS["throttle_statuses"]:
+        raise ThrottledError(url, response.status, parse_retry_after(response.headers.get("retry-after")))
 
 def fetch_html_playwright(url: str) -> Optional[str]:
     """Fetch HTML content using Playwright with proper error handling"""
+    if not PLAYWRIGHT_AVAILABLE:
+        logging.warning("Playwright not installed. Dynamic content fetching will use Selenium fallback.")
+        return None
+    from playwright.sync_api import sync_playwright
+
     try:
-        with sync_playwright() as p:
-            browser = p.chromium.launch(headless=True)
-            context = browser.new_context()
+        with sync_playwright() as p, get_proxy_manager().use(url) as proxy:
+            with span("playwright.launch"):
+                browser = p.chromium.launch(headless=True)
+            context, restored = new_playwright_context(browser, url, proxy)
             page = context.new_page()
-            page.goto(url, wait_until="networkidle")
-            html = page.content()
+            with span("playwright.goto"):
+                check_throttled(url, page.goto(url, wait_until="networkidle"))
+            finish_playwright_session(context, page, url, restored)
+            html = cap_html(page.content(), url)
+            context.close()
             browser.close()
             return html
+    except ThrottledError:
+        raise
     except Exception as e:
         logging.error(f"Failed to fetch URL with Playwright: {str(e)}")
         return None
 
-def fetch_html_selenium(url: str) -> str:
-    """Fallback function to fetch HTML content using Selenium"""
-    # Implement Selenium fetch logic here
-    pass
+class BrowserPool:
+    """A bounded set of long-lived Playwright browsers so repeated fetches skip the launch cost.
+
+    Playwright's sync API is bound to the thread that started it, so each
+    browser lives on one of the pool's own `size` worker threads and fetches
+    are queued to them; callers on any number of threads share those browsers.
+    The workers are plain daemon threads rather than an executor because
+    executors refuse new work once interpreter shutdown begins, before
+    atexit handlers such as close() get to run.
+    """
+
+    _STOP = object()
+
+    def __init__(self, size: int = BROWSER_POOL_SIZE, headless: bool = True):
+        self.size = size
+        self.headless = headless
+        self._local = threading.local()
+        self._tasks = queue.Queue()
+        self._lock = threading.Lock()
+        self._closed = False
+        self._threads = [
+            threading.Thread(target=self._work, name=f"browser-pool-{index}", daemon=True)
+            for index in range(size)
+        ]
+        for thread in self._threads:
+            thread.start()
+
+    def _get_browser(self):
+        browser = getattr(self._local, "browser", None)
+        if browser is not None and browser.is_connected():
+            return browser
+        from playwright.sync_api import sync_playwright
+
+        self._local.playwright = sync_playwright().start()
+        browser = self._local.playwright.chromium.launch(headless=self.headless)
+        self._local.browser = browser
+        return browser
+
+    def fetch(self, url: str) -> Optional[str]:
+        if not PLAYWRIGHT_AVAILABLE:
+            return None
+        future = Future()
+        with self._lock:
+            if self._closed:
+                return None
+            self._tasks.put((future, url, current_trace()))
+        return future.result()
+
+    def _work(self):
+        while True:
+            task = self._tasks.get()
+            if task is self._STOP:
+                break
+            future, url, trace = task
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(self._fetch(url, trace))
+            except BaseException as e:
+                future.set_exception(e)
+        self._close_thread_browser()
 
-def fetch_html(url: str) -> str:
-    """Universal fetch function that tries Playwright first, falls back to Selenium"""
+    def _fetch(self, url: str, trace=None) -> Optional[str]:
+        try:
+            with activate_trace(trace), get_proxy_manager().use(url) as proxy:
+                context, restored = new_playwright_context(self._get_browser(), url, proxy)
+                try:
+                    page = context.new_page()
+                    with span("playwright.goto", pooled=True):
+                        check_throttled(url, page.goto(url, wait_until="networkidle"))
+                    finish_playwright_session(context, page, url, restored)
+                    return cap_html(page.content(), url)
+                finally:
+                    context.close()
+        except ThrottledError:
+            raise
+        except Exception as e:
+            logging.error(f"Failed to fetch URL with pooled Playwright browser: {str(e)}")
+            return None
+
+    def _close_thread_browser(self):
+        browser = getattr(self._local, "browser", None)
+        if browser is None:
+            return
+        try:
+            browser.close()
+            self._local.playwright.stop()
+        except Exception as e:
+            logging.warning(f"Error closing pooled browser: {str(e)}")
+        self._local.browser = None
+
+    def close(self, timeout: float = 30):
+        """Finish queued fetches, then have each worker close its own browser"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+            # One stop marker per worker; each worker exits on the first it takes
+            for _ in self._threads:
+                self._tasks.put(self._STOP)
+        for thread in self._threads:
+            if thread is not threading.current_thread():
+                thread.join(timeout)
+
+def fetch_html(url: str, browser_pool: Optional[BrowserPool] = None, retry: bool = True) -> str:
+    """Universal fetch function that tries Playwright first, falls back to Selenium.
+
+    Pass retry=False when the caller retries already (controlled_fetch).
+    """
+    with span("fetch", url=url):
+        return _fetch_html(url, browser_pool, retry)
+
+def _fetch_html(url: str, browser_pool: Optional[BrowserPool] = None, retry: bool = True) -> str:
+    fetch_html_selenium_fallback = fetch_html_selenium if retry else fetch_html_selenium.__wrapped__
     try:
-        html = fetch_html_playwright(url)
+        html = browser_pool.fetch(url) if browser_pool is not None else fetch_html_playwright(url)
         if html:
             return html
         logging.info("Playwright fetch failed, falling back to Selenium")
-        return fetch_html_selenium(url)
+        return fetch_html_selenium_fallback(url)
+    except ThrottledError:
+        # Switching browsers won't help, let the caller back off instead
+        raise
     except Exception as e:
         logging.error(f"Playwright fetch failed with error: {str(e)}, falling back to Selenium")
-        return fetch_html_selenium(url)
+        return fetch_html_selenium_fallback(url)
 
 if __name__ == "__main__":
+    configure_logging()
     url = 'https://webscraper.io/test-sites/e-commerce/static'
     fields=['Name of item', 'Price']
 
     try:
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        raw_html = fetch_html(url)
-        markdown = html_to_markdown_with_readability(raw_html)
-        save_raw_data(markdown, timestamp)
-        DynamicListingModel = create_dynamic_listing_model(fields)
-        DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-        formatted_data, token_counts = format_data(markdown, DynamicListingsContainer,DynamicListingModel,"Groq Llama3.1 70b")
+        with trace_url(url), track_memory(url):
+            raw_html = fetch_html(url)
+            markdown, structured = page_markdown(raw_html)
+            del raw_html
+            save_raw_data(markdown, timestamp)
+            formatted_data, token_counts = format_page(structured, markdown, fields, "Groq Llama3.1 70b")
         print(formatted_data)
-        save_formatted_data(formatted_data, timestamp)
+        # Listings saved by earlier runs are skipped via the persistent index
+        save_formatted_data(formatted_data, timestamp, deduplicator=get_deduplicator() if DEDUP_SETTINGS["enabled"] else None)
         formatted_data_text = json.dumps(formatted_data.dict() if hasattr(formatted_data, 'dict') else formatted_data) 
         input_tokens, output_tokens, total_cost = calculate_price(token_counts, "Groq Llama3.1 70b")
         print(f"Input token count: {input_tokens}")
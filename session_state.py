@@ -0,0 +1,130 @@
+import json
+import os
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+from urllib.parse import urlparse
+
+from assets import SESSION_STATE_SETTINGS
+
+
+def domain_of(url: str) -> str:
+    return (urlparse(url).hostname or url).lower()
+
+
+class SessionStateStore:
+    """Per-domain browser session state (cookies and localStorage) shared across fetches.
+
+    States are kept in Playwright's storage_state format, in memory and on
+    disk, so consent banners and warm-up only happen once per domain until
+    the state expires.
+    """
+
+    def __init__(self, directory: str = SESSION_STATE_SETTINGS["directory"], ttl: float = SESSION_STATE_SETTINGS["ttl"]):
+        self.directory = directory
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._states: Dict[str, dict] = {}
+
+    def _path(self, domain: str) -> str:
+        return os.path.join(self.directory, re.sub(r"[^a-z0-9.-]", "_", domain) + ".json")
+
+    def _is_fresh(self, entry: dict) -> bool:
+        # Only the TTL retires a whole state; lapsed cookies are dropped one by one in get()
+        return time.time() - entry["saved_at"] <= self.ttl
+
+    def get(self, url: str) -> Optional[dict]:
+        domain = domain_of(url)
+        with self._lock:
+            entry = self._states.get(domain)
+            if entry is None and os.path.exists(self._path(domain)):
+                try:
+                    with open(self._path(domain), 'r', encoding='utf-8') as f:
+                        entry = json.load(f)
+                    self._states[domain] = entry
+                except (OSError, ValueError):
+                    entry = None
+            if entry is None:
+                return None
+            if not self._is_fresh(entry):
+                self._invalidate(domain)
+                return None
+            return live_cookies(entry["state"])
+
+    def save(self, url: str, state: dict):
+        domain = domain_of(url)
+        entry = {"saved_at": time.time(), "state": state}
+        with self._lock:
+            self._states[domain] = entry
+            os.makedirs(self.directory, exist_ok=True)
+            with open(self._path(domain), 'w', encoding='utf-8') as f:
+                json.dump(entry, f)
+
+    def invalidate(self, url: str):
+        with self._lock:
+            self._invalidate(domain_of(url))
+
+    def _invalidate(self, domain: str):
+        self._states.pop(domain, None)
+        try:
+            os.remove(self._path(domain))
+        except FileNotFoundError:
+            pass
+
+
+def live_cookies(state: dict, now: Optional[float] = None) -> dict:
+    """Copy of a state without persistent cookies that have expired.
+
+    Short-lived analytics cookies lapse long before the consent cookie, so
+    they are dropped rather than invalidating the whole state. Session
+    cookies have expires == -1 and are kept.
+    """
+    now = time.time() if now is None else now
+    cookies = [cookie for cookie in state.get("cookies", [])
+               if cookie.get("expires", -1) <= 0 or cookie["expires"] > now]
+    return dict(state, cookies=cookies)
+
+
+def selenium_cookies_to_state(cookies: List[dict], origin: str, local_storage: Dict[str, str]) -> dict:
+    """Convert Selenium cookies and a localStorage dump to storage_state format"""
+    return {
+        "cookies": [
+            {
+                "name": cookie["name"],
+                "value": cookie["value"],
+                "domain": cookie.get("domain", ""),
+                "path": cookie.get("path", "/"),
+                "expires": cookie.get("expiry", -1),
+                "httpOnly": cookie.get("httpOnly", False),
+                "secure": cookie.get("secure", False),
+                "sameSite": cookie.get("sameSite", "Lax")
+            }
+            for cookie in cookies
+        ],
+        "origins": [
+            {"origin": origin, "localStorage": [{"name": name, "value": value} for name, value in local_storage.items()]}
+        ] if local_storage else []
+    }
+
+
+def local_storage_script(state: dict) -> str:
+    """Script that seeds localStorage for matching origins before page scripts run"""
+    origins = {item["origin"]: {entry["name"]: entry["value"] for entry in item.get("localStorage", [])}
+               for item in state.get("origins", [])}
+    return (
+        "const items = " + json.dumps(origins) + "[window.location.origin];\n"
+        "if (items) { for (const [name, value] of Object.entries(items)) { localStorage.setItem(name, value); } }"
+    )
+
+
+_default_store: Optional[SessionStateStore] = None
+_default_lock = threading.Lock()
+
+
+def get_session_store() -> SessionStateStore:
+    global _default_store
+    with _default_lock:
+        if _default_store is None:
+            _default_store = SessionStateStore()
+        return _default_store
@@ -1,25 +1,216 @@
 import streamlit as st
+import atexit
 import os
 import subprocess
-from scraper import (
-    fetch_html,
-    save_raw_data, 
-    format_data,
-    save_formatted_data,
-    calculate_price,
-    html_to_markdown_with_readability,
-    create_dynamic_listing_model, 
-    create_listings_container_model
-)
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from typing import Dict, List
 from streamlit_tags import st_tags
 import pandas as pd
 import json
 from datetime import datetime
-from assets import PRICING
+from assets import PRICING, CONCURRENCY_SETTINGS, DEDUP_SETTINGS
+
+PLAYWRIGHT_CACHE_DIR = os.getenv("PLAYWRIGHT_BROWSERS_PATH", "/home/appuser/.cache/ms-playwright")
+JOB_STAGES = ["queued", "fetching", "converting", "extracting", "done"]
+POLL_INTERVAL = 0.5
+
+@st.cache_resource(show_spinner=False)
+def ensure_playwright_browsers():
+    # Runs once per server process instead of on every rerun
+    if not os.path.exists(PLAYWRIGHT_CACHE_DIR):
+        subprocess.run(["playwright", "install", "chromium"], check=True)
+    return True
+
+@st.cache_resource(show_spinner=False)
+def setup_logging():
+    from scraper import configure_logging
+    configure_logging()
+    return True
+
+@st.cache_resource
+def get_executor():
+    # The adaptive controller decides how many of these actually fetch at once
+    return ThreadPoolExecutor(max_workers=CONCURRENCY_SETTINGS["max_global"], thread_name_prefix="scrape-job")
+
+@st.cache_resource
+def get_browser_pool():
+    from scraper import BrowserPool
+    pool = BrowserPool()
+    # Chromium processes would otherwise outlive the server
+    atexit.register(pool.close)
+    return pool
+
+@st.cache_resource
+def get_fetch_controller():
+    # Fetches go through the browser pool, so no more of them can run than it has browsers
+    from concurrency import ConcurrencyController, capped_settings
+    return ConcurrencyController(capped_settings(get_browser_pool().size))
+
+@st.cache_resource
+def get_llm_client(model_name):
+    from scraper import create_llm_client
+    return create_llm_client(model_name)
 
-# Install Playwright browsers on first run
-if not os.path.exists("/home/appuser/.cache/ms-playwright"):
-    subprocess.run(["playwright", "install", "chromium"], check=True)
+def new_deduplicator():
+    if not DEDUP_SETTINGS["enabled"]:
+        return None
+    from dedup import ListingDeduplicator
+    return ListingDeduplicator(":memory:")
+
+@dataclass
+class ScrapeJob:
+    urls: List[str]
+    fields: List[str]
+    model: str
+    timestamp: str
+    stages: Dict[str, str] = field(default_factory=dict)
+    rows: List[dict] = field(default_factory=list)
+    markdowns: Dict[str, str] = field(default_factory=dict)
+    errors: Dict[str, tuple] = field(default_factory=dict)
+    tokens: Dict[str, int] = field(default_factory=lambda: {"input_tokens": 0, "output_tokens": 0, "cached_input_tokens": 0})
+    df: object = None
+    browser_pool: object = None
+    controller: object = None
+    client: object = None
+    deduplicator: object = None
+    duplicates: int = 0
+    near_duplicates: int = 0
+    peak_rss: Dict[str, int] = field(default_factory=dict)
+    finished: bool = False
+    lock: threading.Lock = field(default_factory=threading.Lock)
+
+    def __post_init__(self):
+        self.stages = {url: "queued" for url in self.urls}
+
+    def set_stage(self, url, stage):
+        with self.lock:
+            self.stages[url] = stage
+
+    def progress(self) -> float:
+        with self.lock:
+            done = sum(JOB_STAGES.index(stage) if stage != "failed" else len(JOB_STAGES) - 1
+                       for stage in self.stages.values())
+        return done / ((len(JOB_STAGES) - 1) * len(self.urls))
+
+    def snapshot(self):
+        with self.lock:
+            return dict(self.stages), list(self.rows), dict(self.errors)
+
+def scrape_one(job: ScrapeJob, index: int, url: str):
+    from scraper import (
+        controlled_fetch,
+        fetch_html,
+        save_raw_data,
+        format_page,
+        page_markdown,
+    )
+    from memory_usage import track_memory
+    from tracing import trace_url
+    stage = "fetching"
+    try:
+        with trace_url(url), track_memory(url) as memory:
+            job.set_stage(url, stage)
+            raw_html = controlled_fetch(
+                url,
+                fetch=lambda target: fetch_html(target, browser_pool=job.browser_pool, retry=False),
+                controller=job.controller
+            )
+            stage = "converting"
+            job.set_stage(url, stage)
+            markdown, structured = page_markdown(raw_html)
+            # Everything format_page needs is in markdown and structured now
+            del raw_html
+            save_raw_data(markdown, f"{job.timestamp}_{index}" if len(job.urls) > 1 else job.timestamp)
+            stage = "extracting"
+            job.set_stage(url, stage)
+            formatted_data, tokens_count = format_page(structured, markdown, job.fields, job.model, client=job.client)
+        rows = formatted_data["listings"]
+        if job.deduplicator is not None:
+            rows, stats = job.deduplicator.filter(rows)
+        with job.lock:
+            job.peak_rss[url] = memory["peak_rss"]
+            if job.deduplicator is not None:
+                job.duplicates += stats["exact"]
+                job.near_duplicates += stats["near"]
+            job.markdowns[url] = markdown
+            job.rows.extend(rows)
+            for key in job.tokens:
+                job.tokens[key] += tokens_count.get(key, 0)
+            job.stages[url] = "done"
+    except Exception as e:
+        with job.lock:
+            job.errors[url] = (stage, e)
+            job.stages[url] = "failed"
+
+def finish_job(job: ScrapeJob):
+    from scraper import save_formatted_data
+    try:
+        if job.rows:
+            job.df = save_formatted_data({"listings": job.rows}, job.timestamp)
+    except Exception as e:
+        job.errors["save"] = ("saving", e)
+    finally:
+        if job.deduplicator is not None:
+            job.deduplicator.close()
+        job.finished = True
+
+def submit_job(urls, fields, model) -> ScrapeJob:
+    job = ScrapeJob(
+        urls=urls,
+        fields=fields,
+        model=model,
+        timestamp=datetime.now().strftime('%Y%m%d_%H%M%S'),
+        browser_pool=get_browser_pool(),
+        controller=get_fetch_controller(),
+        client=get_llm_client(model),
+        # Featured items repeat on every page; drop them within the job
+        deduplicator=new_deduplicator()
+    )
+    remaining = [len(urls)]
+
+    def on_done(_future):
+        with job.lock:
+            remaining[0] -= 1
+            last = remaining[0] == 0
+        if last:
+            finish_job(job)
+
+    # Each URL is its own task so pages of one job scrape in parallel
+    for i, url in enumerate(urls):
+        get_executor().submit(scrape_one, job, i, url).add_done_callback(on_done)
+    return job
+
+def show_error(stage: str, error: Exception):
+    if stage == "extracting" and isinstance(error, ValueError):
+        st.error(f"""
+        ❌ Schema validation error:
+        - Make sure field names are valid (no special characters)
+        - Each field should have a clear data type
+        - Field names should be unique
+        
+        Technical details: {str(error)}
+        """)
+    elif stage == "extracting" and ("400" in str(error) or "CountTokensRequest" in str(error)):
+        st.error(f"""
+        ❌ Model schema error:
+        - Try reducing the number of fields to extract
+        - Make field names shorter and simpler
+        - Verify the data structure is valid
+        
+        Technical details: {str(error)}
+        """)
+    else:
+        st.error(f"""
+        ❌ An error occurred:
+        - Check your internet connection
+        - Verify the URL is accessible
+        - Try again in a few minutes
+        
+        Technical details: {str(error)}
+        """)
 
 st.set_page_config(
     page_title="Web Scraper",
@@ -27,6 +218,9 @@ st.set_page_config(
     layout="wide"
 )
 
+ensure_playwright_browsers()
+setup_logging()
+
 st.markdown("""
     <style>
     .stApp {
@@ -148,7 +342,7 @@ left_col, right_col = st.columns([1, 1])
 
 with left_col:
     st.markdown("### 🔮 Configuration")
-    url_input = st.text_input("Enter URL", placeholder="https://example.com")
+    url_input = st.text_area("Enter URLs (one per line)", placeholder="https://example.com")
     model_selection = st.selectbox("Select Model", options=list(PRICING.keys()), index=0)
     
     st.markdown("### 🏷️ Fields to Extract")
@@ -166,93 +360,82 @@ with right_col:
     st.markdown("### 📊 Results")
     
     if st.button("Start Scraping"):
+        urls = list(dict.fromkeys(line.strip() for line in url_input.splitlines() if line.strip()))
         # Validate inputs before proceeding
+        if not urls:
+            st.error("⚠️ Please enter at least one URL")
+            st.stop()
         if not tags:
             st.error("⚠️ Please add at least one field to extract")
             st.stop()  # Use st.stop() instead of return
-            
-        with st.spinner('🌟 Magic in progress...'):
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            try:
-                raw_html = fetch_html(url_input)
-                markdown = html_to_markdown_with_readability(raw_html)
-                save_raw_data(markdown, timestamp)
-                
-                try:
-                    DynamicListingModel = create_dynamic_listing_model(tags)
-                    DynamicListingsContainer = create_listings_container_model(DynamicListingModel)
-                    formatted_data, tokens_count = format_data(markdown, DynamicListingsContainer, DynamicListingModel, model_selection)
-                
-                except ValueError as schema_error:
-                    st.error(f"""
-                    ❌ Schema validation error:
-                    - Make sure field names are valid (no special characters)
-                    - Each field should have a clear data type
-                    - Field names should be unique
-                    
-                    Technical details: {str(schema_error)}
-                    """)
-                    st.stop()
-                    
-                except Exception as e:
-                    if "400" in str(e) or "CountTokensRequest" in str(e):
-                        st.error(f"""
-                        ❌ Model schema error:
-                        - Try reducing the number of fields to extract
-                        - Make field names shorter and simpler
-                        - Verify the data structure is valid
-                        
-                        Technical details: {str(e)}
-                        """)
-                        st.stop()
-                    raise e  # Re-raise other exceptions
-                
-                # Continue with success path
-                input_tokens, output_tokens, total_cost = calculate_price(tokens_count, model=model_selection)
-                df = save_formatted_data(formatted_data, timestamp)
+        try:
+            st.session_state.job = submit_job(urls, list(tags), model_selection)
+        except Exception as e:
+            show_error("starting", e)
+            st.stop()
+
+    job = st.session_state.get("job")
+    if job is not None:
+        stages, rows, errors = job.snapshot()
+
+        if not job.finished:
+            st.progress(job.progress(), text='🌟 Magic in progress...')
+            progress_table = pd.DataFrame(stages.items(), columns=["URL", "Stage"])
+            progress_table["Peak RSS during page (MB)"] = progress_table["URL"].map(lambda url: round(job.peak_rss.get(url, 0) / 2**20, 1))
+            st.dataframe(progress_table, use_container_width=True, hide_index=True)
+        for url, (stage, error) in errors.items():
+            st.caption(url)
+            show_error(stage, error)
+
+        if rows:
+            if job.finished:
                 st.success("✨ Scraping completed successfully!")
-                st.dataframe(df, use_container_width=True)
-                
-                with st.expander("💫 Token Usage Details"):
-                    col1, col2, col3 = st.columns(3)
-                    col1.metric("Input Tokens", input_tokens)
-                    col2.metric("Output Tokens", output_tokens)
-                    col3.metric("Total Cost", f"${total_cost:.4f}")
-                
-                st.markdown("### 📥 Download Results")
-                col1, col2, col3 = st.columns(3)
-                with col1:
-                    st.download_button(
-                        "📋 JSON",
-                        data=json.dumps(formatted_data.dict() if hasattr(formatted_data, 'dict') else formatted_data, indent=4),
-                        file_name=f"{timestamp}_data.json"
-                    )
-                with col2:
-                    st.download_button(
-                        "📊 CSV",
-                        data=df.to_csv(index=False),
-                        file_name=f"{timestamp}_data.csv"
-                    )
-                with col3:
-                    st.download_button(
-                        "📝 Markdown",
-                        data=markdown,
-                        file_name=f"{timestamp}_data.md"
-                    )
-                    
-            except Exception as e:
-                st.error(f"""
-                ❌ An error occurred:
-                - Check your internet connection
-                - Verify the URL is accessible
-                - Try again in a few minutes
-                
-                Technical details: {str(e)}
-                """)
+            if job.duplicates:
+                st.caption(f"Skipped {job.duplicates} duplicate listings")
+            if job.near_duplicates:
+                st.caption(f"{job.near_duplicates} listings look like near duplicates (kept, see the log)")
+            st.dataframe(job.df if job.finished and job.df is not None else pd.DataFrame(rows), use_container_width=True)
+
+        if job.finished and rows:
+            from scraper import calculate_price
+            input_tokens, output_tokens, total_cost = calculate_price(job.tokens, model=job.model)
+            with st.expander("💫 Token Usage Details"):
+                col1, col2, col3, col4 = st.columns(4)
+                col1.metric("Input Tokens", job.tokens["input_tokens"])
+                col2.metric("Cached Input Tokens", job.tokens["cached_input_tokens"])
+                col3.metric("Output Tokens", job.tokens["output_tokens"])
+                col4.metric("Total Cost", f"${total_cost:.4f}")
+
+            df = job.df if job.df is not None else pd.DataFrame(rows)
+            st.markdown("### 📥 Download Results")
+            col1, col2, col3 = st.columns(3)
+            with col1:
+                st.download_button(
+                    "📋 JSON",
+                    data=json.dumps({"listings": rows}, indent=4),
+                    file_name=f"{job.timestamp}_data.json"
+                )
+            with col2:
+                st.download_button(
+                    "📊 CSV",
+                    data=df.to_csv(index=False),
+                    file_name=f"{job.timestamp}_data.csv"
+                )
+            with col3:
+                st.download_button(
+                    "📝 Markdown",
+                    data="\n\n".join(job.markdowns.values()),
+                    file_name=f"{job.timestamp}_data.md"
+                )
 
 st.markdown(
     "<div class='footer'>"
     "Made by Priyankesh, <a href='https://github.com/priyankeshh' style='color: #9370DB;'>Github</a>"
     "</div>", 
     unsafe_allow_html=True
-)
\ No newline at end of file
+)
+
+# Poll the background job; widget interactions in between don't restart it
+if st.session_state.get("job") is not None and not st.session_state.job.finished:
+    time.sleep(POLL_INTERVAL)
+    st.rerun()
@@ -0,0 +1,222 @@
+import json
+import re
+from typing import Dict, List, Optional, Tuple
+
+from assets import STRUCTURED_DATA_SETTINGS
+
+STOPWORDS = {"of", "the", "a", "an", "item", "items", "product", "listing"}
+SYNONYMS = {
+    "title": "name",
+    "cost": "price",
+    "amount": "price",
+    "link": "url",
+    "href": "url",
+    "stars": "rating",
+    "reviews": "review",
+    "picture": "image",
+    "photo": "image",
+    "summary": "description"
+}
+# Page furniture rather than listings: a lone Organization or WebSite node
+# must not win over the LLM just because it has a name and a url
+NON_LISTING_TYPES = {
+    "Organization", "Corporation", "LocalBusiness", "WebSite", "WebPage",
+    "CollectionPage", "SearchResultsPage", "BreadcrumbList", "ListItem", "ItemList",
+    "SiteNavigationElement", "SearchAction", "ImageObject", "ContactPoint",
+    "PostalAddress", "Person", "Brand", "Thing"
+}
+# Fields that can identify a listing when joining structured rows with LLM rows
+IDENTIFYING_WORDS = {"url", "name", "id", "sku"}
+
+
+def tokenize(text: str) -> set:
+    """Split a field name or source key into normalized words"""
+    text = re.sub(r"([a-z0-9])([A-Z])", r"\1 \2", text)
+    words = re.split(r"[^a-z0-9]+", text.lower())
+    return {SYNONYMS.get(word, word) for word in words if word and word not in STOPWORDS}
+
+
+def flatten(value, prefix: str = "") -> Dict[str, str]:
+    """Flatten nested JSON-LD into dotted keys with string values"""
+    flat = {}
+    if isinstance(value, dict):
+        for key, item in value.items():
+            if key.startswith("@") and key != "@value":
+                continue
+            flat.update(flatten(item, f"{prefix}.{key}" if prefix else key))
+    elif isinstance(value, list):
+        if all(not isinstance(item, (dict, list)) for item in value):
+            flat[prefix] = ", ".join(str(item) for item in value)
+        elif value:
+            flat.update(flatten(value[0], prefix))
+    elif value is not None and str(value).strip():
+        flat[prefix] = str(value).strip()
+    return flat
+
+
+def _json_ld_nodes(data) -> List[dict]:
+    if isinstance(data, list):
+        return [node for item in data for node in _json_ld_nodes(item)]
+    if not isinstance(data, dict):
+        return []
+    if "@graph" in data:
+        return _json_ld_nodes(data["@graph"])
+    if "itemListElement" in data:
+        # ItemList: the listings are the wrapped items
+        items = data["itemListElement"]
+        items = items if isinstance(items, list) else [items]
+        return [node for element in items
+                for node in _json_ld_nodes(element.get("item", element) if isinstance(element, dict) else element)]
+    return [data]
+
+
+def json_ld_groups(soup) -> Dict[str, List[dict]]:
+    """Group JSON-LD nodes by script and type.
+
+    Nodes from different scripts aren't merged: a page's own list (an
+    array, ItemList or @graph) must not be joined with a separate
+    featured-product script into one "listing" source.
+    """
+    groups = {}
+    for index, script in enumerate(soup.find_all("script", type="application/ld+json")):
+        try:
+            data = json.loads(script.string or "")
+        except (TypeError, ValueError):
+            continue
+        for node in _json_ld_nodes(data):
+            node_type = node.get("@type", "Thing")
+            node_type = node_type[0] if isinstance(node_type, list) and node_type else node_type
+            if node_type in NON_LISTING_TYPES:
+                continue
+            groups.setdefault(f"jsonld:{index}:{node_type}", []).append(flatten(node))
+    return groups
+
+
+def _microdata_item(scope) -> Dict[str, str]:
+    record = {}
+    for prop in scope.find_all(attrs={"itemprop": True}):
+        if prop.has_attr("itemscope"):
+            # Nested item: its own properties are picked up with a prefix below
+            continue
+        owner = prop.find_parent(attrs={"itemscope": True})
+        if owner is scope:
+            key = prop["itemprop"]
+        elif owner.has_attr("itemprop") and owner.find_parent(attrs={"itemscope": True}) is scope:
+            key = f"{owner['itemprop']}.{prop['itemprop']}"
+        else:
+            continue
+        value = prop.get("content") or prop.get("href") or prop.get("src") or prop.get_text(" ", strip=True)
+        if value:
+            record.setdefault(key, value)
+    return record
+
+
+def microdata_groups(soup) -> Dict[str, List[dict]]:
+    groups = {}
+    for scope in soup.find_all(attrs={"itemscope": True}):
+        if scope.has_attr("itemprop"):
+            continue
+        item_type = scope.get("itemtype", "Thing").rstrip("/").rsplit("/", 1)[-1]
+        if item_type in NON_LISTING_TYPES:
+            continue
+        record = _microdata_item(scope)
+        if record:
+            groups.setdefault(f"microdata:{item_type}", []).append(record)
+    return groups
+
+
+def table_groups(soup) -> Dict[str, List[dict]]:
+    groups = {}
+    for index, table in enumerate(soup.find_all("table")):
+        rows = table.find_all("tr")
+        if len(rows) < 2:
+            continue
+        headers = [cell.get_text(" ", strip=True) for cell in rows[0].find_all(["th", "td"])]
+        if not any(headers):
+            continue
+        records = []
+        for row in rows[1:]:
+            cells = [cell.get_text(" ", strip=True) for cell in row.find_all(["th", "td"])]
+            record = {header: value for header, value in zip(headers, cells) if header and value}
+            if record:
+                records.append(record)
+        if records:
+            groups[f"table:{index}"] = records
+    return groups
+
+
+def match_key(field_name: str, keys) -> Optional[str]:
+    """Pick the source key that best matches a requested field name.
+
+    All of the field's words (after synonyms) must appear in the key, so
+    "Seller name" doesn't match "name" and "Shipping price" doesn't match
+    "offers.price".
+    """
+    field_tokens = tokenize(field_name)
+    if not field_tokens:
+        return None
+    best, best_score = None, (0.0, 0.0)
+    for key in keys:
+        key_tokens = tokenize(key)
+        overlap = len(field_tokens & key_tokens)
+        if not overlap:
+            continue
+        score = (overlap / len(field_tokens), overlap / len(field_tokens | key_tokens))
+        if score > best_score:
+            best, best_score = key, score
+    if best_score[0] < STRUCTURED_DATA_SETTINGS["min_match_score"]:
+        return None
+    return best
+
+
+def map_group(records: List[dict], field_names: List[str]) -> Tuple[List[dict], List[str]]:
+    """Map one group of records onto the fields; return rows and the fields every row has"""
+    keys = {key for record in records for key in record}
+    mapping = {field: match_key(field, keys) for field in field_names}
+    rows = [{field: record.get(key, "") if key else "" for field, key in mapping.items()} for record in records]
+    covered = [field for field in field_names if mapping[field] and all(row[field] for row in rows)]
+    return rows, covered
+
+
+def join_value(value) -> str:
+    """Normalize a value for joining structured rows with LLM rows"""
+    return re.sub(r"\s+", " ", str(value)).strip().lower().rstrip("/")
+
+
+def join_key(rows: List[dict], covered: List[str]) -> Optional[str]:
+    """Pick a covered field whose values identify each row, or None"""
+    candidates = sorted(covered, key=lambda field: not tokenize(field) & IDENTIFYING_WORDS)
+    for field in candidates:
+        values = [join_value(row[field]) for row in rows]
+        if all(values) and len(set(values)) == len(values):
+            return field
+    return None
+
+
+def structured_groups(soup) -> Dict[str, List[dict]]:
+    """Candidate listing sources from JSON-LD, microdata and tables in a parsed page.
+
+    Call this before script tags are stripped from the soup.
+    """
+    groups = {}
+    for extractor in (json_ld_groups, microdata_groups, table_groups):
+        groups.update(extractor(soup))
+    return groups
+
+
+def select_listings(groups: Dict[str, List[dict]], field_names: List[str]) -> Tuple[List[dict], List[str]]:
+    """Pick the source that best covers the requested fields.
+
+    Returns its rows and the list of fields that are filled on every row.
+    Sources with fewer than min_records rows are ignored: a lone Product on
+    a listing page is usually a featured item, not the listings.
+    """
+    best_rows, best_covered = [], []
+    for records in groups.values():
+        if len(records) < STRUCTURED_DATA_SETTINGS["min_records"]:
+            continue
+        rows, covered = map_group(records, field_names)
+        if (len(covered), len(rows)) > (len(best_covered), len(best_rows)):
+            best_rows, best_covered = rows, covered
+    return best_rows, best_covered
+
@@ -0,0 +1,226 @@
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+from typing import List, Optional
+from urllib.parse import urlparse
+
+from assets import TRACE_SETTINGS
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def tracing_enabled() -> bool:
+    return TRACE_SETTINGS["enabled"] or os.getenv("SCRAPER_TRACE") == "1"
+
+
+class SlowPageSampler:
+    """Samples the stacks of a URL's threads once it has run longer than the threshold.
+
+    The thread that started the URL is sampled from the start; threads that
+    pick up its work later (browser pool, local LLM dispatcher) are added
+    by activate_trace while they work on it.
+    """
+
+    def __init__(self, thread_id: int, threshold: float, interval: float = TRACE_SETTINGS["sample_interval"]):
+        self.threads = Counter({thread_id: 1})
+        self._threads_lock = threading.Lock()
+        self.threshold = threshold
+        self.interval = interval
+        self.triggered = False
+        self.stacks = Counter()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="slow-page-sampler", daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        if self._stop.wait(self.threshold):
+            return
+        self.triggered = True
+        while not self._stop.wait(self.interval):
+            with self._threads_lock:
+                thread_ids = list(self.threads)
+            frames = sys._current_frames()
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for thread_id in thread_ids:
+                frame = frames.get(thread_id)
+                stack = []
+                while frame is not None:
+                    stack.append(f"{frame.f_code.co_name} ({os.path.basename(frame.f_code.co_filename)}:{frame.f_lineno})")
+                    frame = frame.f_back
+                if stack:
+                    # Root each stack at its thread so the flame graph keeps them apart
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.stacks[";".join(reversed(stack))] += 1
+
+    def add_thread(self, thread_id: int):
+        with self._threads_lock:
+            self.threads[thread_id] += 1
+
+    def remove_thread(self, thread_id: int):
+        with self._threads_lock:
+            self.threads[thread_id] -= 1
+            if self.threads[thread_id] <= 0:
+                del self.threads[thread_id]
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def folded(self) -> str:
+        """Collapsed stacks, the input format of flamegraph.pl and speedscope"""
+        return "".join(f"{stack} {count}\n" for stack, count in self.stacks.most_common())
+
+
+class UrlTrace:
+    """Span tree for one URL, exported as Chrome trace events"""
+
+    def __init__(self, url: str):
+        self.url = url
+        self.origin = time.perf_counter()
+        self.events: List[dict] = []
+        self.files: List[str] = []
+        self.sampler: Optional[SlowPageSampler] = None
+        host = re.sub(r"[^A-Za-z0-9.-]", "_", urlparse(url).netloc or "page")
+        self.basename = os.path.join(TRACE_SETTINGS["directory"], f"{time.strftime('%Y%m%d_%H%M%S')}_{host}_{time.time_ns() % 10**6}")
+
+    def add_span(self, name: str, start: float, end: float, args: dict):
+        self.events.append({
+            "name": name,
+            "ph": "X",
+            "ts": (start - self.origin) * 1e6,
+            "dur": (end - start) * 1e6,
+            "pid": os.getpid(),
+            "tid": threading.get_ident(),
+            "args": args
+        })
+
+    def write(self, sampler: Optional[SlowPageSampler] = None) -> str:
+        os.makedirs(TRACE_SETTINGS["directory"], exist_ok=True)
+        if sampler is not None and sampler.stacks:
+            folded_path = self.basename + ".folded"
+            with open(folded_path, 'w', encoding='utf-8') as f:
+                f.write(sampler.folded())
+            self.files.append(folded_path)
+        path = self.basename + ".json"
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({
+                "traceEvents": sorted(self.events, key=lambda event: event["ts"]),
+                "displayTimeUnit": "ms",
+                "metadata": {"url": self.url, "files": self.files}
+            }, f)
+        logger.info(f"Trace for {self.url} written to {path}")
+        return path
+
+
+def current_trace() -> Optional[UrlTrace]:
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def activate_trace(trace: Optional[UrlTrace]):
+    """Continue a URL's trace on another thread, e.g. a browser pool worker"""
+    previous = current_trace()
+    _local.trace = trace
+    sampler = trace.sampler if trace is not None else None
+    thread_id = threading.get_ident()
+    if sampler is not None:
+        sampler.add_thread(thread_id)
+    try:
+        yield trace
+    finally:
+        if sampler is not None:
+            sampler.remove_thread(thread_id)
+        _local.trace = previous
+
+
+@contextmanager
+def span(name: str, **args):
+    """Time a stage of the current URL; a no-op when no trace is active"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException as e:
+        args["error"] = repr(e)
+        raise
+    finally:
+        trace.add_span(name, start, time.perf_counter(), args)
+
+
+@contextmanager
+def profile_cpu(name: str, **args):
+    """A span that, with cpu_profile on, also runs the stage under cProfile"""
+    trace = current_trace()
+    if trace is None or not TRACE_SETTINGS["cpu_profile"] or not tracing_enabled():
+        with span(name, **args):
+            yield
+        return
+    import cProfile
+
+    profiler = cProfile.Profile()
+    path = f"{trace.basename}_{name}.prof"
+    os.makedirs(TRACE_SETTINGS["directory"], exist_ok=True)
+    with span(name, profile=path, **args):
+        try:
+            profiler.enable()
+        except ValueError:
+            # Another profiler is already active on this interpreter
+            profiler = None
+        try:
+            yield
+        finally:
+            if profiler is not None:
+                profiler.disable()
+                profiler.dump_stats(path)
+                trace.files.append(path)
+
+
+def har_path() -> Optional[str]:
+    """Where Playwright should record HAR for the current URL, if requested"""
+    trace = current_trace()
+    if trace is None or not TRACE_SETTINGS["har"] or not tracing_enabled():
+        return None
+    path = f"{trace.basename}_{len(trace.files)}.har"
+    os.makedirs(TRACE_SETTINGS["directory"], exist_ok=True)
+    trace.files.append(path)
+    return path
+
+
+@contextmanager
+def trace_url(url: str):
+    """Root span for one URL.
+
+    Spans are kept in memory while the URL runs; the trace is written when
+    tracing is enabled, or when the URL ran past the slow threshold, in
+    which case the sampled stacks are written next to it.
+    """
+    if current_trace() is not None or not (tracing_enabled() or TRACE_SETTINGS["slow_threshold"]):
+        yield current_trace()
+        return
+    trace = UrlTrace(url)
+    _local.trace = trace
+    sampler = SlowPageSampler(threading.get_ident(), TRACE_SETTINGS["slow_threshold"]) if TRACE_SETTINGS["slow_threshold"] else None
+    trace.sampler = sampler
+    try:
+        with span("url", url=url):
+            yield trace
+    finally:
+        _local.trace = None
+        if sampler is not None:
+            sampler.stop()
+        if tracing_enabled() or (sampler is not None and sampler.triggered):
+            try:
+                trace.write(sampler)
+            except OSError as e:
+                logger.warning(f"Could not write trace for {url}: {e}")